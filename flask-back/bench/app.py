@@ -0,0 +1,41 @@
+"""The Flask app wired to the fake Gemini and BigQuery clients.
+
+Run it directly (`python -m bench.app --port 5055`) or under gunicorn
+(`gunicorn -k gthread --threads 16 bench.app:app`) to benchmark the same way production runs.
+Latencies come from BENCH_* environment variables, in seconds.
+"""
+import argparse
+import os
+
+# The background warm-up and charts refresh would talk to the real services
+os.environ.setdefault("CHAT_WARMUP", "0")
+os.environ.setdefault("CHARTS_REFRESH", "0")
+
+import main  # noqa: E402
+
+from bench import fakes  # noqa: E402
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(__file__), "questions.jsonl")
+
+fakes.install(
+    main,
+    fakes.load_corpus(os.environ.get("BENCH_QUESTIONS", QUESTIONS_PATH)),
+    gemini_latency=fakes.Latency(
+        float(os.environ.get("BENCH_GEMINI_LATENCY", "0.8")),
+        float(os.environ.get("BENCH_GEMINI_JITTER", "0.2")),
+    ),
+    bigquery_latency=fakes.Latency(
+        float(os.environ.get("BENCH_BIGQUERY_LATENCY", "1.0")),
+        float(os.environ.get("BENCH_BIGQUERY_JITTER", "0.3")),
+    ),
+    dry_run_latency=fakes.Latency(float(os.environ.get("BENCH_DRY_RUN_LATENCY", "0.2"))),
+)
+app = main.app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the app with fake Gemini/BigQuery clients.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,247 @@
+"""Local stand-ins for Gemini and BigQuery so /chat can be benchmarked offline.
+
+The fakes mimic the parts of the SDK surface main.py uses (chat sessions with history,
+streaming and usage metadata; query jobs with dry runs, stats and timestamps) and sleep
+for a configurable latency instead of doing network I/O. SQL comes from the question
+corpus and result frames are synthesized from BIGQUERY_TABLE_SCHEMA.
+"""
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from cache import canonicalize_sql, normalize_question
+
+OSTANS = ["تهران", "اصفهان", "فارس", "خراسان رضوی", "آذربایجان شرقی", "خوزستان", "گیلان", "کرمان"]
+SUMMARY_TEXT = "بر اساس نتایج پرسش، تعداد افراد مورد نظر در جدول محاسبه شد و خلاصه آن در ادامه آمده است."
+
+
+def parse_schema(schema_text):
+    """{column: BigQuery type} from the bullet list in BIGQUERY_TABLE_SCHEMA."""
+    return dict(re.findall(r"- `(\w+)` \((\w+)\)", schema_text))
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Latency:
+    """Fixed delay plus optional uniform jitter, in seconds."""
+
+    def __init__(self, base, jitter=0.0, seed=0):
+        self.base = base
+        self.jitter = jitter
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        if not self.jitter:
+            return self.base
+        with self._lock:
+            return max(0.0, self.base + self._rng.uniform(-self.jitter, self.jitter))
+
+    def sleep(self):
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+
+
+# === GEMINI ===
+
+class UsageMetadata:
+    def __init__(self, prompt, output):
+        self.prompt_token_count = len(prompt) // 4
+        self.candidates_token_count = len(output) // 4
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, prompt, chunks=None):
+        self.text = text
+        self.usage_metadata = UsageMetadata(prompt, text)
+        self._chunks = chunks
+
+    def __iter__(self):
+        return iter(self._chunks or [self])
+
+
+class FakeChatSession:
+    def __init__(self, model):
+        self.model = model
+        self.history = []
+
+    def send_message(self, content, stream=False, **kwargs):
+        text = self.model.reply(content)
+        self.history = self.history + [{"role": "user", "parts": [content]}, {"role": "model", "parts": [text]}]
+        if not stream:
+            self.model.latency.sleep()
+            return FakeResponse(text, content)
+        # Lazy, like the SDK: the call returns at once and chunks arrive while iterating
+        return FakeResponse(text, content, chunks=self._stream_chunks(text, content))
+
+    def _stream_chunks(self, text, prompt):
+        words = text.split(" ")
+        size = max(1, len(words) // self.model.stream_chunks)
+        # First chunk after the time-to-first-token, the rest spread over the remaining latency
+        total = self.model.latency.sample()
+        parts = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+        for i, part in enumerate(parts):
+            time.sleep(total / 2 if i == 0 else total / 2 / max(1, len(parts) - 1))
+            yield FakeResponse(part, prompt)
+
+    def rewind(self):
+        self.history = self.history[:-2]
+
+
+class FakeGenerativeModel:
+    """Answers 'Generate a SQL query to answer: <question>' with the corpus SQL, anything else with a summary."""
+
+    def __init__(self, corpus, latency, stream_chunks=8):
+        self.latency = latency
+        self.stream_chunks = stream_chunks
+        self.sql_by_question = {normalize_question(item["question"]): item["sql"] for item in corpus}
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self)
+
+    def reply(self, prompt):
+        match = re.search(r"Generate a (?:corrected )?SQL query to answer: (.*)$", prompt, re.S)
+        if match is None:
+            return SUMMARY_TEXT
+        sql = self.sql_by_question.get(normalize_question(match.group(1)))
+        if sql is None:
+            return "این پرسش با داده‌های جدول قابل پاسخ نیست."
+        return f"{sql}\n---SQL_END---\nاین پرسش با یک کوئری ساده روی جدول پاسخ داده می‌شود."
+
+
+# === BIGQUERY ===
+
+class TableReference:
+    def __init__(self, project, dataset_id, table_id):
+        self.project = project
+        self.dataset_id = dataset_id
+        self.table_id = table_id
+
+
+class FakeRowIterator:
+    page_size = 500
+
+    def __init__(self, frame):
+        self._frame = frame
+        self.total_rows = len(frame)
+
+    def to_dataframe(self, **kwargs):
+        return self._frame.copy()
+
+    def to_arrow(self, **kwargs):
+        return pa.Table.from_pandas(self._frame, preserve_index=False)
+
+    def to_arrow_iterable(self, bqstorage_client=None, **kwargs):
+        # Batches the size of REST result pages
+        return iter(self.to_arrow().to_batches(max_chunksize=self.page_size))
+
+    def __iter__(self):
+        return iter(self._frame.itertuples(index=False))
+
+
+class FakeQueryJob:
+    _ids = 0
+    _ids_lock = threading.Lock()
+
+    def __init__(self, frame, latency, dry_run=False, referenced_tables=()):
+        with FakeQueryJob._ids_lock:
+            FakeQueryJob._ids += 1
+            self.job_id = f"fake-job-{FakeQueryJob._ids}"
+        self._frame = frame
+        self._latency = latency
+        self.state = "DONE" if dry_run else "RUNNING"
+        self.total_bytes_processed = int(frame.memory_usage(deep=True).sum())
+        self.slot_millis = None if dry_run else int(latency * 1000)
+        self.cache_hit = False
+        self.referenced_tables = list(referenced_tables)
+        self.created = datetime.now(timezone.utc)
+        self.started = None
+        self.ended = None
+
+    def result(self, timeout=None, **kwargs):
+        # A fifth of the latency is queueing, the rest execution, like a lightly loaded project
+        time.sleep(self._latency / 5)
+        self.started = datetime.now(timezone.utc)
+        time.sleep(self._latency * 4 / 5)
+        self.ended = datetime.now(timezone.utc)
+        self.state = "DONE"
+        return FakeRowIterator(self._frame)
+
+
+class FakeBigQueryClient:
+    def __init__(self, corpus, schema, latency, dry_run_latency=None, seed=0):
+        self.schema = schema
+        self.latency = latency
+        self.dry_run_latency = dry_run_latency or Latency(0.0)
+        self.seed = seed
+        self.specs = [(canonicalize_sql(item["sql"]), item) for item in corpus]
+
+    def _spec(self, sql):
+        canonical = canonicalize_sql(sql)
+        for spec_sql, item in self.specs:
+            # The guard may have appended/clamped a LIMIT, so match on the prefix
+            if canonical.startswith(spec_sql) or spec_sql in canonical:
+                return item
+        return {"rows": 1, "columns": []}
+
+    def frame_for(self, sql):
+        spec = self._spec(sql)
+        columns = spec.get("columns") or [name for name in self.schema if re.search(rf"\b{name}\b", sql)][:8]
+        rows = spec.get("rows", 1)
+        # Honor the LIMIT the guard injected or clamped
+        limit = re.search(r"\bLIMIT\s+(\d+)\s*$", sql, re.I)
+        if limit:
+            rows = min(rows, int(limit.group(1)))
+        return synthetic_frame(columns, rows, self.schema, self.seed)
+
+    def query(self, sql, job_config=None, **kwargs):
+        dry_run = bool(job_config is not None and job_config.dry_run)
+        frame = self.frame_for(sql)
+        if dry_run:
+            self.dry_run_latency.sleep()
+            referenced = [TableReference(*ref) for ref in set(re.findall(r"`([\w-]+)\.(\w+)\.(\w+)`", sql))]
+            return FakeQueryJob(frame, 0.0, dry_run=True, referenced_tables=referenced)
+        return FakeQueryJob(frame, self.latency.sample())
+
+    def list_rows(self, table, **kwargs):
+        frame = synthetic_frame(list(self.schema), 1000, self.schema, self.seed)
+        return FakeRowIterator(frame)
+
+
+def synthetic_frame(columns, rows, schema, seed=0):
+    """Random frame with the given columns; `name:TYPE` declares columns that aren't in the schema."""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for column in columns:
+        name, _, declared = column.partition(":")
+        kind = declared or schema.get(name, "FLOAT")
+        if kind == "INTEGER":
+            data[name] = rng.integers(0, 2 if name in schema else 100_000, size=rows)
+        elif kind == "STRING":
+            data[name] = rng.choice(OSTANS, size=rows)
+        else:
+            data[name] = rng.gamma(2.0, 2_500_000.0, size=rows).round(2)
+    if not data:
+        data["value"] = rng.integers(0, 100_000, size=rows)
+    return pd.DataFrame(data)
+
+
+def install(main, corpus, gemini_latency, bigquery_latency, dry_run_latency=None, stream_chunks=8):
+    """Points main's lazily created clients at the fakes; call before the first request."""
+    with main.init_lock:
+        main.model = FakeGenerativeModel(corpus, gemini_latency, stream_chunks)
+        main.bigquery_client = FakeBigQueryClient(
+            corpus, parse_schema(main.BIGQUERY_TABLE_SCHEMA), bigquery_latency, dry_run_latency)
+        main.initialized = True
+    return main.model, main.bigquery_client
@@ -0,0 +1,240 @@
+"""Replays the question corpus against the chat API at a fixed concurrency.
+
+By default a server with the fake clients (bench/app.py) is started in a subprocess, so the
+numbers cover the real request path (sessions, cache, guard, limiters, reducer, tracing)
+without network calls or billing. Results are written as JSON so runs can be compared:
+
+    python -m bench.run --concurrency 8 --requests 200 --label baseline
+    python -m bench.run --concurrency 8 --requests 200 --label arrow --compare bench/results/<baseline>.json
+
+Pass --url to drive an already running server instead (peak RSS is then not reported).
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+from bench.fakes import load_corpus
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+QUESTIONS_PATH = os.path.join(BENCH_DIR, "questions.jsonl")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+COMPARED = ("p50_s", "p95_s", "p99_s", "first_answer_p50_s", "rps", "error_rate", "peak_rss_mb")
+ANSWER_EVENTS = (b"event: answer_chunk", b"event: done", b"event: error")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def post(url, payload, timeout):
+    """Returns (status, seconds to the first piece of the answer, seconds to last byte).
+
+    For SSE that is the first answer_chunk (or done/error) event; the session and progress
+    events before it say nothing about when the user starts reading an answer.
+    """
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    started = time.perf_counter()
+    first_answer = None
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            status = response.status
+            if response.headers.get_content_type() == "text/event-stream":
+                # The request is done when the server closes the stream
+                for line in response:
+                    if first_answer is None and line.startswith(ANSWER_EVENTS):
+                        first_answer = time.perf_counter() - started
+            else:
+                response.read()
+    except urllib.error.HTTPError as e:
+        status = e.code
+        e.read()
+    except (urllib.error.URLError, OSError):
+        status = "connection_error"
+    total = time.perf_counter() - started
+    return status, total if first_answer is None else first_answer, total
+
+
+def get_json(url, timeout=5):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+
+
+def start_server(args, log_path):
+    env = dict(os.environ)
+    env.update({
+        "BENCH_QUESTIONS": args.questions,
+        "BENCH_GEMINI_LATENCY": str(args.gemini_latency),
+        "BENCH_GEMINI_JITTER": str(args.gemini_jitter),
+        "BENCH_BIGQUERY_LATENCY": str(args.bigquery_latency),
+        "BENCH_BIGQUERY_JITTER": str(args.bigquery_jitter),
+        "BENCH_DRY_RUN_LATENCY": str(args.dry_run_latency),
+    })
+    if args.no_cache:
+        env["CHAT_CACHE_BACKEND"] = "memory"
+        env["CHAT_CACHE_MAX_ENTRIES"] = "0"
+    log = open(log_path, "w", encoding="utf-8")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "bench.app", "--port", str(args.port)],
+        cwd=os.path.dirname(BENCH_DIR), env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + 60
+    while get_json(base_url + "/", timeout=1) is None:
+        if server.poll() is not None or time.monotonic() > deadline:
+            server.kill()
+            raise SystemExit(f"Benchmark server did not start; see {log_path}")
+        time.sleep(0.2)
+    return server, base_url
+
+
+def stop_server(server):
+    """Stops the server and returns its peak RSS in MB."""
+    server.terminate()
+    server.wait(timeout=30)
+    # ru_maxrss of waited-for children; the server is the only child this process starts
+    return round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+
+
+def drive(base_url, corpus, args):
+    """Runs `args.requests` questions on `args.concurrency` workers; returns per-request samples."""
+    samples = []
+    lock = threading.Lock()
+    next_index = iter(range(args.requests))
+
+    def worker(number):
+        # One session per simulated user, like the browser does
+        session_id = f"bench-{number}"
+        while True:
+            with lock:
+                index = next(next_index, None)
+            if index is None:
+                return
+            item = corpus[index % len(corpus)]
+            payload = {"question": item["question"], "session_id": session_id}
+            if args.format:
+                payload["format"] = args.format
+            status, first_answer, total = post(base_url + args.route, payload, args.timeout)
+            with lock:
+                samples.append({"status": status, "first_answer_s": first_answer, "latency_s": total})
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, wall_s):
+    latencies = [s["latency_s"] for s in samples]
+    first_answers = [s["first_answer_s"] for s in samples]
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample["status"])] = statuses.get(str(sample["status"]), 0) + 1
+    errors = sum(count for status, count in statuses.items() if status != "200")
+    return {
+        "requests": len(samples),
+        "wall_s": round(wall_s, 3),
+        "rps": round(len(samples) / wall_s, 2) if wall_s else None,
+        "p50_s": round(percentile(latencies, 50), 4),
+        "p95_s": round(percentile(latencies, 95), 4),
+        "p99_s": round(percentile(latencies, 99), 4),
+        "max_s": round(max(latencies), 4),
+        "first_answer_p50_s": round(percentile(first_answers, 50), 4),
+        "first_answer_p95_s": round(percentile(first_answers, 95), 4),
+        "error_rate": round(errors / len(samples), 4),
+        "statuses": statuses,
+    }
+
+
+def print_report(result, baseline=None):
+    summary = result["summary"]
+    print(f"{summary['requests']} requests to {result['config']['route']} "
+          f"at concurrency {result['config']['concurrency']} in {summary['wall_s']}s")
+    for key in COMPARED:
+        value = summary.get(key)
+        line = f"  {key:<18} {value}"
+        if baseline is not None:
+            before = baseline["summary"].get(key)
+            if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before:
+                line += f"  (was {before}, {(value - before) / before:+.1%})"
+        print(line)
+    print(f"  statuses           {summary['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=0, help="Unmeasured requests sent first, e.g. to fill the caches.")
+    parser.add_argument("--route", default="/chat", choices=["/chat", "/chat/stream"])
+    parser.add_argument("--format", choices=["columnar", "arrow"], help="Ask /chat for the raw rows too.")
+    parser.add_argument("--questions", default=QUESTIONS_PATH)
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one.")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--gemini-latency", type=float, default=0.8)
+    parser.add_argument("--gemini-jitter", type=float, default=0.2)
+    parser.add_argument("--bigquery-latency", type=float, default=1.0)
+    parser.add_argument("--bigquery-jitter", type=float, default=0.3)
+    parser.add_argument("--dry-run-latency", type=float, default=0.2)
+    parser.add_argument("--no-cache", action="store_true", help="Disable the question/result/answer caches.")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output", help="Result file (default: bench/results/<timestamp>-<label>.json).")
+    parser.add_argument("--compare", help="Earlier result file to print deltas against.")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.questions)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"{stamp}-{args.label}.json")
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = start_server(args, os.path.splitext(output)[0] + ".server.log")
+    try:
+        if args.warmup:
+            drive(base_url, corpus, argparse.Namespace(**{**vars(args), "requests": args.warmup}))
+        samples, wall_s = drive(base_url, corpus, args)
+        server_stats = {path: get_json(base_url + path) for path in ("/cache/stats", "/summary/stats", "/load")}
+    finally:
+        peak_rss_mb = stop_server(server) if server is not None else None
+
+    summary = summarize(samples, wall_s)
+    summary["peak_rss_mb"] = peak_rss_mb
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    result = {"label": args.label, "started_at": stamp, "config": config,
+              "summary": summary, "server": server_stats}
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Two-tier cache for the /chat pipeline.
+
+Tier 1 maps a normalized question to the raw Gemini SQL response, tier 2 maps a
+canonicalized SQL query to its result frame (and the summary built from it).
+Tier 1 is shared by all sessions, so callers only use it for questions asked without
+earlier conversation context.
+Each tier sits on a pluggable backend: in-process memory (per worker) or SQLite
+(shared by every gunicorn worker on the host).
+"""
+import hashlib
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# === NORMALIZATION ===
+
+# Arabic code points that Persian keyboards/IMEs produce interchangeably
+_CHAR_MAP = str.maketrans({
+    "ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه",
+    "\u200c": " ", "\u200f": "", "\u200e": "",  # ZWNJ / bidi marks
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic-Indic digits
+})
+_TRAILING_PUNCT = " \t\n?؟.!،,;:"
+# Next to the app (data/ is gitignored), not in a world-writable directory like /tmp
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "chat_cache.sqlite3")
+_SQL_TOKEN = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)", re.S)
+
+
+def normalize_question(question):
+    """Folds spelling/spacing variants of the same question onto one key."""
+    text = unicodedata.normalize("NFKC", question).translate(_CHAR_MAP)
+    text = re.sub(r"[\u064b-\u0652]", "", text)  # harakat
+    text = " ".join(text.lower().split())
+    return text.strip(_TRAILING_PUNCT)
+
+
+def canonicalize_sql(sql):
+    """Strips comments, collapses whitespace and drops the trailing ';' outside of literals."""
+    parts = _SQL_TOKEN.split(sql)
+    out = []
+    for i, part in enumerate(parts):
+        if i % 2:  # quoted literal / identifier, keep verbatim
+            out.append(part)
+            continue
+        part = re.sub(r"--[^\n]*|#[^\n]*", " ", part)
+        part = re.sub(r"/\*.*?\*/", " ", part, flags=re.S)
+        out.append(" ".join(part.split()))
+    # re-join with single spaces around literals, then tidy
+    text = " ".join(p for p in out if p)
+    return text.strip().rstrip(";").strip()
+
+
+def _key(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+# === BACKENDS ===
+
+def _sizeof(value):
+    """Rough in-memory size of a cached value, in bytes."""
+    if hasattr(value, "memory_usage"):  # dataframe
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return sys.getsizeof(value)
+
+
+class MemoryBackend:
+    """Per-process LRU dict with TTL; the fastest option but not shared between workers.
+
+    Bounded by entry count and by the total size of the values, whichever is hit first.
+    """
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value, size = entry
+            if expires_at < time.time():
+                del self._data[key]
+                self.total_bytes -= size
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        size = _sizeof(value)
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous[2]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (time.time() + ttl, value, size)
+            self.total_bytes += size
+            while len(self._data) > self.max_entries or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteBackend:
+    """LRU/TTL table in a SQLite file so all gunicorn workers share hits.
+
+    Bounded by entry count and by the total size of the pickled values, like MemoryBackend.
+    """
+
+    def __init__(self, path, table, max_entries, max_bytes=None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # Values are unpickled on read, so the file must live in a directory only the app can write
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value BLOB, expires_at REAL, last_access REAL, size INTEGER)"
+            )
+            # Files created before the size budget lack the column
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            if "size" not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN size INTEGER")
+                conn.execute(f"UPDATE {table} SET size = LENGTH(value)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_lru ON {table}(last_access)")
+
+    def _connect(self):
+        # One short-lived connection per call keeps this safe across threads and forks
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.max_bytes is not None and len(blob) > self.max_bytes:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access, size) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(blob), now + ttl, now, len(blob)),
+            )
+            conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            if self.max_bytes is not None:
+                # Keep the most recently used entries whose sizes add up to the budget
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM ("
+                    f"SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS running "
+                    f"FROM {self.table}) WHERE running > ?)",
+                    (self.max_bytes,),
+                )
+
+    @property
+    def total_bytes(self):
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+def make_backend(kind, table, max_entries, path=None, max_bytes=None):
+    if kind == "memory":
+        return MemoryBackend(max_entries, max_bytes)
+    if kind == "sqlite":
+        return SQLiteBackend(path, table, max_entries, max_bytes)
+    raise ValueError(f"Unknown cache backend: {kind!r}")
+
+
+# === TWO-TIER CACHE ===
+
+class QueryCache:
+    """question -> SQL response (tier 1) and SQL -> result frame / answer (tier 2)."""
+
+    def __init__(self, sql_backend, result_backend, sql_ttl, result_ttl,
+                 max_result_bytes, namespace=""):
+        self.sql_backend = sql_backend
+        self.result_backend = result_backend
+        self.sql_ttl = sql_ttl
+        self.result_ttl = result_ttl
+        self.max_result_bytes = max_result_bytes
+        # Bumping the namespace (e.g. a table id) invalidates every entry at once
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.counters = {name: 0 for name in (
+            "sql_hits", "sql_misses", "result_hits", "result_misses",
+            "answer_hits", "answer_misses", "result_too_large",
+        )}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _lookup(self, backend, key, tier):
+        try:
+            value = backend.get(key)
+        except Exception as e:  # a broken cache must never break /chat
+            print(f"Cache {tier} lookup failed: {e}")
+            value = None
+        self._count(f"{tier}_hits" if value is not None else f"{tier}_misses")
+        return value
+
+    def _store(self, backend, key, value, ttl, tier):
+        try:
+            backend.set(key, value, ttl)
+        except Exception as e:
+            print(f"Cache {tier} store failed: {e}")
+
+    # --- tier 1: question -> Gemini SQL response ---
+    def get_sql_response(self, question):
+        return self._lookup(self.sql_backend, _key(self.namespace, "q", normalize_question(question)), "sql")
+
+    def put_sql_response(self, question, response_text):
+        self._store(self.sql_backend, _key(self.namespace, "q", normalize_question(question)),
+                    response_text, self.sql_ttl, "sql")
+
+    # --- tier 2: SQL -> result frame ---
+    def get_result(self, sql):
+        return self._lookup(self.result_backend, _key(self.namespace, "r", canonicalize_sql(sql)), "result")
+
+    def put_result(self, sql, results_df):
+        if results_df.memory_usage(deep=True).sum() > self.max_result_bytes:
+            self._count("result_too_large")
+            return
+        self._store(self.result_backend, _key(self.namespace, "r", canonicalize_sql(sql)),
+                    results_df, self.result_ttl, "result")
+
+    # The summary is only as fresh as the rows behind it, so it lives in tier 2 with the same TTL
+    def get_answer(self, question, sql):
+        return self._lookup(self.result_backend,
+                            _key(self.namespace, "a", canonicalize_sql(sql), normalize_question(question)),
+                            "answer")
+
+    def put_answer(self, question, sql, answer):
+        self._store(self.result_backend,
+                    _key(self.namespace, "a", canonicalize_sql(sql), normalize_question(question)),
+                    answer, self.result_ttl, "result")
+
+    def clear(self):
+        self.sql_backend.clear()
+        self.result_backend.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        for tier in ("sql", "result", "answer"):
+            total = stats[f"{tier}_hits"] + stats[f"{tier}_misses"]
+            stats[f"{tier}_hit_rate"] = round(stats[f"{tier}_hits"] / total, 4) if total else 0.0
+        try:
+            stats["sql_entries"] = len(self.sql_backend)
+            stats["result_entries"] = len(self.result_backend)
+            stats["result_bytes"] = self.result_backend.total_bytes
+        except Exception:
+            pass
+        return stats
+
+
+def from_env(namespace=""):
+    """Builds the cache from CHAT_CACHE_* environment variables."""
+    kind = os.environ.get("CHAT_CACHE_BACKEND", "memory")
+    path = os.environ.get("CHAT_CACHE_PATH", DEFAULT_SQLITE_PATH)
+    max_entries = int(os.environ.get("CHAT_CACHE_MAX_ENTRIES", "512"))
+    # Total size of the cached values per tier (per worker for memory, per file for SQLite)
+    max_bytes = int(os.environ.get("CHAT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    return QueryCache(
+        sql_backend=make_backend(kind, "sql_cache", max_entries, path, max_bytes),
+        result_backend=make_backend(kind, "result_cache", max_entries, path, max_bytes),
+        sql_ttl=int(os.environ.get("CHAT_CACHE_SQL_TTL", str(24 * 3600))),
+        result_ttl=int(os.environ.get("CHAT_CACHE_RESULT_TTL", "3600")),
+        max_result_bytes=int(os.environ.get("CHAT_CACHE_MAX_RESULT_BYTES", str(8 * 1024 * 1024))),
+        namespace=namespace,
+    )
@@ -0,0 +1,139 @@
+"""Pre-aggregated dashboard data for /api/charts_data.
+
+One small GROUP BY query (gender x urban x age band) is rolled up in pandas into every view
+the dashboard draws. The encoded body, its gzip variant and the ETag are computed once per
+refresh, so requests only pay for a dict lookup and conditional-GET checks.
+"""
+import gzip
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+import results
+
+AGE_BANDS = [(18, "0-17"), (30, "18-29"), (45, "30-44"), (60, "45-59"), (None, "60+")]
+GENDER_LABELS = {1: "مرد", 2: "زن"}
+URBAN_LABELS = {1: "شهری", 0: "روستایی"}
+SHAPARAK_YEARS = [1400, 1401, 1402]
+
+
+def charts_sql(full_table_id):
+    age_band = " ".join(
+        f"WHEN age < {upper} THEN '{label}'" for upper, label in AGE_BANDS if upper is not None
+    )
+    shaparak = ",\n  ".join(
+        f"SUM(shaparak_monthly_{year}_avg) AS shaparak_{year}_sum, "
+        f"COUNT(shaparak_monthly_{year}_avg) AS shaparak_{year}_n"
+        for year in SHAPARAK_YEARS
+    )
+    return f"""SELECT
+  gender,
+  urban,
+  CASE WHEN age IS NULL THEN 'unknown' {age_band} ELSE '{AGE_BANDS[-1][1]}' END AS age_band,
+  COUNT(*) AS people,
+  SUM(hadafmandi) AS hadafmandi,
+  SUM(subsidy_cash) AS subsidy_cash,
+  {shaparak}
+FROM `{full_table_id}`
+GROUP BY gender, urban, age_band"""
+
+
+def _rate(numerator, denominator):
+    return round(float(numerator) / float(denominator), 4) if denominator else None
+
+
+def _distribution(groups_df, column, labels=None, order=None):
+    """Columnar {key, label, count, coverage rates} arrays for one dimension."""
+    rolled = groups_df.groupby(column, dropna=False)[["people", "hadafmandi", "subsidy_cash"]].sum()
+    if order is not None:
+        rolled = rolled.reindex([key for key in order if key in rolled.index])
+    keys = [None if key != key else (key.item() if hasattr(key, "item") else key) for key in rolled.index]
+    data = {column: keys}
+    if labels is not None:
+        data["label"] = [labels.get(key, str(key)) for key in keys]
+    data["count"] = [int(value) for value in rolled["people"]]
+    data["hadafmandi_rate"] = [_rate(h, p) for h, p in zip(rolled["hadafmandi"], rolled["people"])]
+    data["subsidy_cash_rate"] = [_rate(s, p) for s, p in zip(rolled["subsidy_cash"], rolled["people"])]
+    return data
+
+
+def build_payload(groups_df):
+    total = int(groups_df["people"].sum())
+    sums = groups_df.sum(numeric_only=True)
+    return {
+        "total": total,
+        "coverage": {
+            "hadafmandi": _rate(sums["hadafmandi"], total),
+            "subsidy_cash": _rate(sums["subsidy_cash"], total),
+        },
+        "by_gender": _distribution(groups_df, "gender", GENDER_LABELS),
+        "by_urban": _distribution(groups_df, "urban", URBAN_LABELS),
+        "by_age_band": _distribution(groups_df, "age_band",
+                                     order=[label for _, label in AGE_BANDS] + ["unknown"]),
+        "shaparak_yearly_avg": {
+            "year": SHAPARAK_YEARS,
+            "avg": [
+                None if not sums[f"shaparak_{year}_n"]
+                else round(float(sums[f"shaparak_{year}_sum"] / sums[f"shaparak_{year}_n"]), 2)
+                for year in SHAPARAK_YEARS
+            ],
+        },
+    }
+
+
+class ChartsSnapshot:
+    """One encoded version of the payload plus everything needed for conditional GETs."""
+
+    def __init__(self, payload):
+        # The tag covers the data only, so an unchanged refresh keeps clients' cached copies valid
+        self.etag = hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        payload = {"generated_at": self.last_modified.isoformat(), **payload}
+        self.body = results.dumps(payload)
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+
+
+class ChartsService:
+    def __init__(self, run_sql, full_table_id, refresh_interval):
+        self.run_sql = run_sql
+        self.sql = charts_sql(full_table_id)
+        self.refresh_interval = refresh_interval
+        self.snapshot = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        groups_df = self.run_sql(self.sql)
+        snapshot = ChartsSnapshot(build_payload(groups_df))
+        if self.snapshot is not None and self.snapshot.etag == snapshot.etag:
+            return self.snapshot
+        self.snapshot = snapshot
+        print(f"Charts data refreshed: {len(self.snapshot.body)} bytes ({len(self.snapshot.gzip_body)} gzipped)")
+        return self.snapshot
+
+    def get(self):
+        """Returns the current snapshot, computing the first one on demand."""
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            if self.snapshot is None:
+                self._refresh()
+            return self.snapshot
+
+    def start_refresh_loop(self):
+        def loop():
+            while True:
+                time.sleep(self.refresh_interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    # Keep serving the previous snapshot
+                    print(f"Charts data refresh failed: {e}")
+
+        threading.Thread(target=loop, daemon=True, name="charts-refresh").start()
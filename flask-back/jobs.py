@@ -0,0 +1,255 @@
+"""Bounded concurrency for Gemini/BigQuery calls and a submit-then-poll job runner for /chat.
+
+Each upstream gets its own Limiter, so a burst of slow BigQuery jobs can't starve Gemini calls
+(and vice versa). Callers over the queue bound get Overloaded, which the routes turn into
+429 + Retry-After instead of letting requests pile up on the worker.
+
+A job runs in the worker that accepted it, but its state is published to a job store. The
+SQLite store (the default) is shared by every gunicorn worker on the host, so a poll that
+lands on another worker still finds the job; the memory store only works with one process.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "chat_jobs.sqlite3")
+
+
+class Overloaded(Exception):
+    def __init__(self, resource, retry_after):
+        super().__init__(f"Too many concurrent {resource} requests, retry in {retry_after}s")
+        self.resource = resource
+        self.retry_after = retry_after
+
+
+class Limiter:
+    """At most `max_concurrent` callers inside, at most `max_waiting` queued behind them."""
+
+    def __init__(self, name, max_concurrent, max_waiting, wait_timeout, retry_after):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_waiting:
+                    self.rejected += 1
+                    raise Overloaded(self.name, self.retry_after)
+                self.waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.wait_timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.rejected += 1
+                raise Overloaded(self.name, self.retry_after)
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.max_concurrent, "active": self.active,
+                    "waiting": self.waiting, "rejected": self.rejected}
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        data = {"job_id": self.id, "status": self.status}
+        if self.status == "done":
+            data.update(self.result)
+        elif self.status == "error":
+            data["error"] = self.error
+        return data
+
+    def state(self):
+        return {"id": self.id, "status": self.status, "result": self.result, "error": self.error,
+                "created_at": self.created_at, "finished_at": self.finished_at}
+
+    @classmethod
+    def from_state(cls, state):
+        job = cls(state["id"])
+        job.status = state["status"]
+        job.result = state["result"]
+        job.error = state["error"]
+        job.created_at = state["created_at"]
+        job.finished_at = state["finished_at"]
+        return job
+
+
+class MemoryJobStore:
+    """Jobs in this process only; fine for a single worker (e.g. gunicorn -w 1 --threads N)."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            now = time.time()
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and now - job.finished_at > self.ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def __len__(self):
+        return len(self._jobs)
+
+
+class SQLiteJobStore:
+    """Job states in a SQLite file, visible to every worker process on the host."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS chat_jobs (id TEXT PRIMARY KEY, state TEXT, finished_at REAL)")
+
+    def _connect(self):
+        # One short-lived connection per call keeps this safe across threads and forks
+        return sqlite3.connect(self.path, timeout=5)
+
+    def save(self, job):
+        state = json.dumps(job.state(), ensure_ascii=False, default=str)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO chat_jobs VALUES (?, ?, ?)", (job.id, state, job.finished_at))
+            conn.execute("DELETE FROM chat_jobs WHERE finished_at < ?", (time.time() - self.ttl,))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT state FROM chat_jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_state(json.loads(row[0])) if row is not None else None
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM chat_jobs").fetchone()[0]
+
+
+class JobRunner:
+    """Runs /chat requests on a fixed thread pool so the HTTP worker is free while they wait on I/O."""
+
+    def __init__(self, max_workers, max_pending, store, retry_after):
+        self.max_pending = max_pending
+        self.store = store
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-job")
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, fn, *args):
+        """Queues `fn(*args)`; its return value (a dict) becomes the job result."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise Overloaded("chat job", self.retry_after)
+            self.pending += 1
+        job = Job(uuid.uuid4().hex)
+        try:
+            self.store.save(job)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            raise
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        job.status = "running"
+        self._save(job)
+        try:
+            job.result = fn(*args)
+            job.status = "done"
+        except Exception as e:
+            print(f"Error in chat job {job.id}: {e}")
+            job.error = str(e)
+            job.status = "error"
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            with self._lock:
+                self.pending -= 1
+
+    def _save(self, job):
+        try:
+            self.store.save(job)
+        except Exception as e:
+            print(f"Could not save the state of chat job {job.id}: {e}")
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            stats = {"pending": self.pending, "max_pending": self.max_pending}
+        try:
+            stats["tracked"] = len(self.store)
+        except Exception:
+            pass
+        return stats
+
+
+def limiters_from_env():
+    """Builds the (gemini, bigquery) limiters from CHAT_* environment variables."""
+    max_waiting = int(os.environ.get("CHAT_LIMIT_QUEUE", "16"))
+    wait_timeout = float(os.environ.get("CHAT_LIMIT_QUEUE_TIMEOUT", "30"))
+    retry_after = int(os.environ.get("CHAT_RETRY_AFTER", "5"))
+    gemini = Limiter("Gemini", int(os.environ.get("CHAT_GEMINI_CONCURRENCY", "4")),
+                     max_waiting, wait_timeout, retry_after)
+    bigquery = Limiter("BigQuery", int(os.environ.get("CHAT_BIGQUERY_CONCURRENCY", "4")),
+                       max_waiting, wait_timeout, retry_after)
+    return gemini, bigquery
+
+
+def runner_from_env():
+    """Builds the runner from CHAT_JOB_* environment variables."""
+    ttl = int(os.environ.get("CHAT_JOB_TTL", "600"))
+    kind = os.environ.get("CHAT_JOB_STORE", "sqlite")
+    if kind == "sqlite":
+        store = SQLiteJobStore(os.environ.get("CHAT_JOB_STORE_PATH", DEFAULT_STORE_PATH), ttl)
+    elif kind == "memory":
+        store = MemoryJobStore(ttl)
+    else:
+        raise ValueError(f"Unknown job store: {kind!r}")
+    return JobRunner(
+        max_workers=int(os.environ.get("CHAT_JOB_WORKERS", "8")),
+        max_pending=int(os.environ.get("CHAT_JOB_MAX_PENDING", "64")),
+        store=store,
+        retry_after=int(os.environ.get("CHAT_RETRY_AFTER", "5")),
+    )
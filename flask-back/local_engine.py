@@ -0,0 +1,199 @@
+"""Local columnar replica of the Refah table, queried in-process with DuckDB.
+
+The table is snapshotted from BigQuery into a zstd-compressed Parquet file and Gemini's
+BigQuery SQL is translated to DuckDB SQL where it can be. Queries the translation can't
+handle (BigQuery-only functions, other tables, DuckDB errors) go to BigQuery instead,
+unless QUERY_ENGINE=local, which never touches GCP and only needs the Parquet file.
+
+    python local_engine.py refresh    # snapshot the table into LOCAL_REPLICA_PATH
+"""
+import os
+import re
+import threading
+import time
+
+try:
+    import duckdb
+    import pyarrow.parquet as pq
+except ImportError:  # optional: without them QUERY_ENGINE=bigquery is the only mode
+    duckdb = None
+    pq = None
+
+LOCAL_TABLE = "refah"
+DEFAULT_REPLICA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "refah.parquet")
+
+ENGINE_MODES = ("bigquery", "auto", "local")
+
+# BigQuery features DuckDB has no equivalent for (or different semantics)
+_BIGQUERY_ONLY = re.compile(
+    r"\b(APPROX_QUANTILES|APPROX_TOP_COUNT|APPROX_TOP_SUM|INFORMATION_SCHEMA|FOR\s+SYSTEM_TIME|"
+    r"_TABLE_SUFFIX|ML\.|SAFE\.|NET\.|PARSE_DATE|FORMAT_DATE|PARSE_TIMESTAMP|FORMAT_TIMESTAMP)",
+    re.I,
+)
+# Straight renames from BigQuery to DuckDB names
+_RENAMES = [
+    (re.compile(r"\bSAFE_CAST\s*\(", re.I), "TRY_CAST("),
+    (re.compile(r"\bFLOAT64\b", re.I), "DOUBLE"),
+    (re.compile(r"\bLOGICAL_AND\s*\(", re.I), "BOOL_AND("),
+    (re.compile(r"\bLOGICAL_OR\s*\(", re.I), "BOOL_OR("),
+]
+# BigQuery functions DuckDB lacks, defined once per connection
+_MACROS = [
+    "CREATE MACRO safe_divide(a, b) AS CASE WHEN b = 0 THEN NULL ELSE a / b END",
+    "CREATE MACRO div(a, b) AS a // b",
+]
+_STRING_LITERAL = re.compile(r"('(?:[^'\\]|\\.)*')", re.S)
+
+
+class LocalReplica:
+    def __init__(self, path, project, dataset, table, max_age):
+        self.path = path
+        self.max_age = max_age
+        self.full_table_id = f"{project}.{dataset}.{table}"
+        p, d, t = (re.escape(part) for part in (project, dataset, table))
+        # `project.dataset.table`, `project`.`dataset`.`table`, dataset.table, table ...
+        self._table_ref = re.compile(
+            rf"`(?:{p}\.)?(?:{d}\.)?{t}`|(?<![\w.`])(?:`?{p}`?\.)?(?:`?{d}`?\.)?`?{t}`?(?![\w`])"
+        )
+        self._conn = None
+        self._lock = threading.Lock()
+        self.counters = {"local": 0, "fallback": 0, "untranslatable": 0}
+
+    @property
+    def available(self):
+        return duckdb is not None and os.path.exists(self.path)
+
+    def age(self):
+        return time.time() - os.path.getmtime(self.path)
+
+    def _connection(self):
+        with self._lock:
+            if self._conn is None:
+                conn = duckdb.connect(database=":memory:")
+                # BigQuery sorts NULLs first on ASC and last on DESC; DuckDB defaults to last on both,
+                # so ORDER BY ... LIMIT would silently pick different rows
+                conn.execute("SET default_null_order = 'nulls_first_on_asc_last_on_desc'")
+                for macro in _MACROS:
+                    conn.execute(macro)
+                # A view, not a copy: every query reads the current file, so refreshes need no reload
+                path = os.path.abspath(self.path).replace("'", "''")
+                conn.execute(f"CREATE VIEW {LOCAL_TABLE} AS SELECT * FROM read_parquet('{path}')")
+                # The SQL comes from Gemini: DuckDB can read any file (read_text, read_csv, COPY...)
+                # and the guard can't know every way to reach those, so the replica is the only
+                # file this connection may touch, and queries can't SET their way back out
+                conn.execute(f"SET allowed_paths = ['{path}']")
+                conn.execute("SET enable_external_access = false")
+                conn.execute("SET lock_configuration = true")
+                self._conn = conn
+            return self._conn
+
+    # === SQL TRANSLATION ===
+
+    def translate(self, sql):
+        """BigQuery SQL -> DuckDB SQL, or None when it should run on BigQuery."""
+        parts = _STRING_LITERAL.split(sql)
+        code = " ".join(parts[::2])
+        if _BIGQUERY_ONLY.search(code) or not self._table_ref.search(code):
+            return None
+        for i in range(0, len(parts), 2):
+            part = self._table_ref.sub(LOCAL_TABLE, parts[i])
+            for pattern, replacement in _RENAMES:
+                part = pattern.sub(replacement, part)
+            # Remaining backticks quote column names
+            parts[i] = re.sub(r"`([^`]*)`", r'"\1"', part)
+        return "".join(parts)
+
+    def query(self, sql):
+        """Runs translated SQL; returns a dataframe, or None if the query has to go to BigQuery."""
+        local_sql = self.translate(sql)
+        if local_sql is None:
+            self._count("untranslatable")
+            return None
+        # A cursor per call gives each request thread its own DuckDB connection state
+        cursor = self._connection().cursor()
+        try:
+            results_df = cursor.execute(local_sql).df()
+        except duckdb.Error as e:
+            print(f"Local engine could not run the query, falling back to BigQuery: {e}")
+            self._count("fallback")
+            return None
+        finally:
+            cursor.close()
+        self._count("local")
+        return results_df
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # === REFRESH ===
+
+    def refresh(self, bigquery_client):
+        """Snapshots the BigQuery table into the Parquet file, replacing it atomically."""
+        import fcntl
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock_file:
+            try:
+                # Every gunicorn worker runs the refresh loop; only one of them downloads
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            if os.path.exists(self.path) and self.age() < self.max_age:
+                return False
+            print(f"Refreshing local replica of {self.full_table_id}...")
+            table = bigquery_client.list_rows(self.full_table_id).to_arrow()
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            pq.write_table(table, tmp_path, compression="zstd")
+            os.replace(tmp_path, self.path)
+            print(f"Local replica refreshed: {table.num_rows} rows -> {self.path}")
+            return True
+
+    def start_refresh_loop(self, get_bigquery_client, interval):
+        def loop():
+            while True:
+                try:
+                    self.refresh(get_bigquery_client())
+                except Exception as e:
+                    print(f"Local replica refresh failed: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, daemon=True, name="replica-refresh").start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["available"] = self.available
+        stats["age_seconds"] = round(self.age()) if stats["available"] else None
+        return stats
+
+
+def engine_mode():
+    mode = os.environ.get("QUERY_ENGINE", "bigquery")
+    if mode not in ENGINE_MODES:
+        raise ValueError(f"QUERY_ENGINE must be one of {ENGINE_MODES}, got {mode!r}")
+    if mode != "bigquery" and duckdb is None:
+        raise RuntimeError(f"QUERY_ENGINE={mode} needs the duckdb and pyarrow packages")
+    return mode
+
+
+def from_env(project, dataset, table):
+    return LocalReplica(
+        path=os.environ.get("LOCAL_REPLICA_PATH", DEFAULT_REPLICA_PATH),
+        project=project, dataset=dataset, table=table,
+        max_age=int(os.environ.get("LOCAL_REPLICA_MAX_AGE", str(6 * 3600))),
+    )
+
+
+if __name__ == "__main__":
+    import sys
+
+    from google.cloud import bigquery
+
+    from main import DATASET_ID, PROJECT_ID, TABLE_ID
+
+    if sys.argv[1:] != ["refresh"]:
+        sys.exit("usage: python local_engine.py refresh")
+    replica = from_env(PROJECT_ID, DATASET_ID, TABLE_ID)
+    replica.max_age = 0
+    replica.refresh(bigquery.Client(project=PROJECT_ID))
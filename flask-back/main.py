@@ -1,9 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS # Import CORS
 import os
+import json
+import threading
+import uuid
 import google.generativeai as genai
 from google.cloud import bigquery
 import pandas as pd
+import cache
+import sessions
+import jobs
+import summarize
+import local_engine
+import charts
+import sql_guard
+import metrics
+import results
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for all origins. Consider restricting this in production.
@@ -17,6 +29,10 @@ DATASET_ID = "Refah_CSV"
 TABLE_ID = "table_CSV_Mapped_1000"
 FULL_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
 
+# --- QUERY ENGINE ---
+# "bigquery" (default), "auto" (local DuckDB replica with BigQuery fallback) or "local" (no GCP at all)
+QUERY_ENGINE = local_engine.engine_mode()
+
 # Define your BigQuery table schema for Gemini's context
 BIGQUERY_TABLE_SCHEMA = """
 جدول 'table_CSV_Mapped_1000' در مجموعه داده 'Refah_CSV' شامل اطلاعات اجتماعی-اقتصادی و داده‌های تراکنش‌های مالی افراد است.
@@ -172,11 +188,93 @@ BIGQUERY_TABLE_SCHEMA = """
 - `AMT_23_1402_0106` (FLOAT): مبلغ خرید کارتی در 6 ماه اول (فروردین تا شهریور) سال 1402 شمسی از صنف 'مذهبی و عام‌المنفعه'.
 """
 
-# === GLOBAL STATE (lazy init on first /ask) ===
+SYSTEM_PROMPT = f"""You are a helpful data analyst AI.
+You have access to a BigQuery table with the following full ID: `{FULL_TABLE_ID}`.
+This is the table schema:
+{BIGQUERY_TABLE_SCHEMA}
+
+When I ask a question about the data, your task is to first generate a valid SQL query for BigQuery that answers my question.
+**Important:** Do NOT include any backticks or formatting around the SQL query. Just output the raw SQL.
+If the question cannot be answered by a single SQL query, state that and then provide a natural language response in persian language. make sure your default language to respond is Persian.
+After the SQL, if you have generated one, you should output an indicator like '---SQL_END---'.
+Then, after '---SQL_END---', you can provide a natural language explanation or summary of what the query does.
+Do NOT execute the query yourself. Only provide the SQL.
+"""
+
+# === GLOBAL STATE (warmed up at start, lazily re-tried on first /chat) ===
 model = None
-chat = None
 bigquery_client = None
+bqstorage_client = None
 initialized = False
+init_lock = threading.Lock()
+
+
+def init_clients():
+    """Creates the Gemini model and BigQuery client exactly once per process."""
+    global model, bigquery_client, bqstorage_client, initialized
+    if initialized:
+        return
+    with init_lock:
+        if initialized:
+            return
+        genai.configure(api_key=GEMINI_API_KEY)
+        # The instructions live in the system prompt so trimming a session's history never drops them
+        model = genai.GenerativeModel("models/gemini-1.5-pro", system_instruction=SYSTEM_PROMPT)
+        if QUERY_ENGINE != "local":
+            bigquery_client = bigquery.Client(project=PROJECT_ID)
+            try:
+                bqstorage_client = results.storage_client()
+            except Exception as e:
+                # Not fatal: results are then downloaded over the REST API
+                print(f"BigQuery Storage client unavailable: {e}")
+        initialized = True
+        print("Gemini model and BigQuery client initialized.")
+
+
+def warm_up():
+    try:
+        init_clients()
+    except Exception as e:
+        # Not fatal: the first /chat request retries the initialization
+        print(f"Warm-up failed: {e}")
+
+
+# One Gemini conversation per client session instead of one shared by everybody
+chat_sessions = sessions.from_env(lambda: model.start_chat())
+
+# Separate caps on in-flight Gemini calls and BigQuery jobs; excess callers queue, then get a 429
+gemini_limiter, bigquery_limiter = jobs.limiters_from_env()
+# Thread pool behind POST /chat/jobs for submit-then-poll clients
+chat_jobs = jobs.runner_from_env()
+
+# Parquet snapshot of the table for the local engine (QUERY_ENGINE=auto/local)
+local_replica = local_engine.from_env(PROJECT_ID, DATASET_ID, TABLE_ID)
+
+# Read-only/single-table checks, LIMIT clamp, dry-run byte budget and job timeout for generated SQL
+query_guard = sql_guard.from_env(FULL_TABLE_ID)
+
+# Shrinks large results before they are pasted into the summarization prompt
+result_reducer = summarize.from_env()
+
+# Dashboard aggregates behind /api/charts_data, recomputed every CHARTS_REFRESH_INTERVAL seconds
+charts_service = charts.ChartsService(
+    lambda sql: (init_clients(), execute_query(sql))[1],
+    FULL_TABLE_ID,
+    refresh_interval=int(os.environ.get("CHARTS_REFRESH_INTERVAL", "900")),
+)
+
+# Question->SQL and SQL->result cache; backend/TTLs come from CHAT_CACHE_* env vars
+query_cache = cache.from_env(namespace=FULL_TABLE_ID)
+
+# Component stats read at scrape time: running totals are counters, the rest point-in-time gauges
+metrics.registry.stats("chat_cache", query_cache.stats, counters=query_cache.counters)
+metrics.registry.stats("chat_summary", result_reducer.stats,
+                       counters=[*result_reducer.counters, "estimated_tokens_saved"])
+metrics.registry.stats("chat_limiter_gemini", gemini_limiter.stats, counters=["rejected"])
+metrics.registry.stats("chat_limiter_bigquery", bigquery_limiter.stats, counters=["rejected"])
+metrics.registry.stats("chat_jobs", chat_jobs.stats)
+metrics.registry.stats("chat_sessions", lambda: {"live": len(chat_sessions)})
+metrics.registry.stats("local_engine", local_replica.stats, counters=local_replica.counters)
 
 # === FLASK ROUTES ===
 
@@ -196,94 +294,530 @@ def test_route():
     """Returns a simple JSON response to indicate the API is running."""
     return jsonify({"status": "API is running", "message": " the app route is working f ok! "}), 200
 
+@app.route("/cache/stats")
+def cache_stats():
+    """Returns hit/miss counters for the question and result caches of this worker."""
+    return jsonify(query_cache.stats()), 200
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    global model, chat, bigquery_client, initialized
+@app.route("/summary/stats")
+def summary_stats():
+    """Returns how many results were reduced or templated and the prompt bytes/tokens saved."""
+    return jsonify(result_reducer.stats()), 200
+
+@app.route("/engine/stats")
+def engine_stats():
+    """Returns how many queries ran on the local replica versus fell back to BigQuery."""
+    return jsonify({"mode": QUERY_ENGINE, **local_replica.stats()}), 200
 
-    user_question = request.json.get("question")
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus text exposition of stage latencies, BigQuery/Gemini usage and cache/limiter state."""
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/load")
+def load_stats():
+    """Returns in-flight/queued counts for the Gemini and BigQuery limiters and the job pool."""
+    return jsonify({
+        "gemini": gemini_limiter.stats(),
+        "bigquery": bigquery_limiter.stats(),
+        "jobs": chat_jobs.stats(),
+    }), 200
+
+
+# === CHAT PIPELINE ===
+# The stages are shared by the blocking /chat route and the streaming /chat/stream route.
+
+NO_RESULTS_ANSWER = "هیچ نتیجه‌ای برای پرسش شما یافت نشد."
+
+
+class ChatError(Exception):
+    """A pipeline failure that should reach the client with its own HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def read_chat_request():
+    """Validates the /chat body; returns (question, session_id)."""
+    body = request.get_json(silent=True) or {}
+    user_question = body.get("question")
     if not user_question:
-        return jsonify({"error": "No question provided"}), 400
+        raise ChatError("No question provided")
+    session_id = str(body.get("session_id") or request.headers.get("X-Session-Id") or chat_sessions.new_id())
+    if len(session_id) > sessions.MAX_SESSION_ID_LENGTH:
+        raise ChatError("session_id is too long")
+    return user_question, session_id
 
-    try:
-        # === One-time Initialization ===
-        if not initialized:
-            genai.configure(api_key=GEMINI_API_KEY)
-            model = genai.GenerativeModel("models/gemini-1.5-pro")
 
-            bigquery_client = bigquery.Client(project=PROJECT_ID)
+def parse_sql_response(gemini_response_text):
+    """Splits Gemini's reply into (sql_query, explanation, direct_answer)."""
+    if "---SQL_END---" not in gemini_response_text:
+        # If no SQL_END indicator, Gemini decided to give a direct natural language response
+        print(f"Gemini provided direct natural language response: {gemini_response_text}")
+        return "", "", gemini_response_text
 
-            chat = model.start_chat()
-            chat.send_message(f"""You are a helpful data analyst AI.
-You have access to a BigQuery table with the following full ID: `{FULL_TABLE_ID}`.
-This is the table schema:
-{BIGQUERY_TABLE_SCHEMA}
+    parts = gemini_response_text.split("---SQL_END---", 1)
+    sql_query = parts[0].strip()
+    explanation = parts[1].strip() if len(parts) > 1 else ""
+    # Check if Gemini actually provided a SQL query to execute
+    if not sql_query:
+        print("Gemini did not generate a SQL query.")
+        raise ChatError("Gemini could not generate a SQL query for that question or provided a direct answer.")
+    print(f"Generated SQL Query: {sql_query}")
+    return sql_query, explanation, None
+
+
+def guard_query(sql_query):
+    """Static guard plus, when BigQuery will run it, a dry run against the byte budget."""
+    sql_query = query_guard.check(sql_query)
+    # Queries the replica answers never reach BigQuery, so they skip the dry-run round trip
+    if QUERY_ENGINE != "local" and not runs_locally(sql_query):
+        dry_run(sql_query)
+    return sql_query
+
+
+def dry_run(sql_query):
+    estimated = query_guard.dry_run(bigquery_client, sql_query)
+    print(f"Dry run: query would process {estimated} bytes.")
 
-When I ask a question about the data, your task is to first generate a valid SQL query for BigQuery that answers my question.
-**Important:** Do NOT include any backticks or formatting around the SQL query. Just output the raw SQL.
-If the question cannot be answered by a single SQL query, state that and then provide a natural language response in persian language. make sure your default language to respond is Persian.
-After the SQL, if you have generated one, you should output an indicator like '---SQL_END---'.
-Then, after '---SQL_END---', you can provide a natural language explanation or summary of what the query does.
-Do NOT execute the query yourself. Only provide the SQL.
-""")
-            initialized = True
-            print("Gemini model and BigQuery client initialized.")
 
-        # === Step 1: Ask Gemini to generate SQL ===
-        # Pass the user's direct question to Gemini to get a SQL query
-        sql_gen_response = chat.send_message(f"Generate a SQL query to answer: {user_question}")
+def generate_sql(session, user_question):
+    """Step 1: returns (sql_query, explanation, direct_answer) with the SQL already guarded."""
+    # Repeated questions reuse the SQL Gemini produced last time (only guarded SQL is cached).
+    # The cache is shared by all sessions, so only a session's first question may use it:
+    # a follow-up like "same for women" means something different in every conversation.
+    trace = metrics.current()
+    prompt = f"Generate a SQL query to answer: {user_question}"
+    shareable = chat_sessions.is_fresh(session)
+    if shareable:
+        gemini_response_text = query_cache.get_sql_response(user_question)
+        trace.cache("sql", gemini_response_text is not None)
+        if gemini_response_text is not None:
+            print("SQL cache hit.")
+            # Keep the session's history as if Gemini had answered, for its follow-ups
+            chat_sessions.record(session, prompt, gemini_response_text)
+            sql_query, explanation, direct_answer = parse_sql_response(gemini_response_text)
+            if direct_answer is None:
+                sql_query = query_guard.check(sql_query)
+            return sql_query, explanation, direct_answer
+
+    # Pass the user's direct question to Gemini to get a SQL query
+    # One bounded retry: a rejected query goes back to Gemini with the reason
+    for attempt in range(2):
+        with trace.stage("sql_generation"), gemini_limiter.slot():
+            sql_gen_response = chat_sessions.send(session, prompt)
+        trace.gemini_usage("sql", sql_gen_response)
         gemini_response_text = sql_gen_response.text.strip()
+        sql_query, explanation, direct_answer = parse_sql_response(gemini_response_text)
+        if direct_answer is not None:
+            if shareable:
+                query_cache.put_sql_response(user_question, gemini_response_text)
+            return sql_query, explanation, direct_answer
+        try:
+            with trace.stage("sql_guard"):
+                sql_query = guard_query(sql_query)
+        except sql_guard.SqlRejected as e:
+            print(f"SQL guard rejected the query (attempt {attempt + 1}): {e}")
+            trace.set(sql_rejections=attempt + 1)
+            if attempt:
+                raise ChatError(f"The generated SQL query was rejected: {e}")
+            prompt = (f"The SQL query you generated was rejected: {e}\n"
+                      f"Generate a corrected SQL query to answer: {user_question}")
+            continue
+        if shareable:
+            query_cache.put_sql_response(user_question, f"{sql_query}\n---SQL_END---\n{explanation}")
+        return sql_query, explanation, None
+
+
+def job_stats(job):
+    return {
+        "job_id": job.job_id,
+        "state": job.state,
+        "total_bytes_processed": job.total_bytes_processed,
+        "slot_millis": job.slot_millis,
+        "cache_hit": job.cache_hit,
+    }
+
+
+def start_query(sql_query):
+    """Step 2a: submits the query; returns the BigQuery job without waiting for it."""
+    print("Executing BigQuery query...")
+    return bigquery_client.query(sql_query, job_config=query_guard.job_config())
+
+
+def fetch_results(job, keep_arrow=False):
+    """Step 2b: waits for the job and returns its rows as a dataframe.
 
-        # Parse Gemini's response to extract SQL
-        sql_query = ""
-        explanation = ""
-        if "---SQL_END---" in gemini_response_text:
-            parts = gemini_response_text.split("---SQL_END---", 1)
-            sql_query = parts[0].strip()
-            explanation = parts[1].strip() if len(parts) > 1 else ""
-            print(f"Generated SQL Query: {sql_query}")
+    With `keep_arrow` it returns (dataframe, Arrow table) instead, for callers that send the
+    raw rows on without converting the dataframe back to Arrow.
+    """
+    trace = metrics.current()
+    with trace.stage("bigquery_wait"):
+        query_results = job.result(timeout=query_guard.timeout) # Waits for the job to complete
+    print("BigQuery query executed successfully.")
+    trace.bigquery_job(job)
+
+    # Arrow batches up to the row cap, then a single conversion to pandas
+    with trace.stage("download"):
+        table, truncated = results.read_arrow(query_results, query_guard.max_rows, bqstorage_client)
+    if truncated:
+        print(f"Result truncated to {query_guard.max_rows} rows.")
+        trace.set(result_truncated=True)
+    with trace.stage("to_dataframe"):
+        if keep_arrow:
+            return results.to_frame(table, self_destruct=False), table
+        return results.to_frame(table)
+
+
+def replica_usable():
+    if QUERY_ENGINE == "bigquery" or not local_replica.available:
+        return False
+    # In auto mode a replica whose refreshes keep failing is too stale to trust
+    return QUERY_ENGINE == "local" or local_replica.age() < 2 * local_replica.max_age
+
+
+def runs_locally(sql_query):
+    """True when the query will be tried on the local replica first."""
+    return replica_usable() and local_replica.translate(sql_query) is not None
+
+
+def run_local(sql_query):
+    """Step 2 on the local replica; returns None when the query has to go to BigQuery."""
+    if QUERY_ENGINE == "bigquery":
+        return None
+    tried = runs_locally(sql_query)
+    results_df = None
+    if tried:
+        with metrics.current().stage("local_query"):
+            results_df = local_replica.query(sql_query)
+    if results_df is None:
+        if QUERY_ENGINE == "local":
+            raise ChatError("This query can't run on the local replica and BigQuery is disabled (QUERY_ENGINE=local).", 503)
+        if tried:
+            # guard_query skipped the dry run expecting the replica to answer; BigQuery needs it now
+            try:
+                dry_run(sql_query)
+            except sql_guard.SqlRejected as e:
+                raise ChatError(f"The generated SQL query was rejected: {e}")
+        return None
+    print("Query executed on the local replica.")
+    metrics.current().set(engine="local")
+    return results_df
+
+
+def execute_query(sql_query, keep_arrow=False):
+    """Step 2 without the cache: the local replica when enabled, otherwise BigQuery.
+
+    With `keep_arrow` it returns (dataframe, Arrow table or None), like fetch_results().
+    """
+    results_df = run_local(sql_query)
+    if results_df is not None:
+        return (results_df, None) if keep_arrow else results_df
+    with bigquery_limiter.slot():
+        return fetch_results(start_query(sql_query), keep_arrow)
+
+
+def run_query(sql_query, keep_arrow=False):
+    """Step 2: returns the result frame, from the cache when possible.
+
+    With `keep_arrow` it returns (dataframe, Arrow table or None), like fetch_results().
+    """
+    trace = metrics.current()
+    table = None
+    results_df = query_cache.get_result(sql_query)
+    trace.cache("result", results_df is not None)
+    if results_df is not None:
+        print("Result cache hit.")
+    else:
+        if keep_arrow:
+            results_df, table = execute_query(sql_query, keep_arrow)
         else:
-            # If no SQL_END indicator, Gemini decided to give a direct natural language response
-            print(f"Gemini provided direct natural language response: {gemini_response_text}")
-            return jsonify({"answer": gemini_response_text})
-
-        # Check if Gemini actually provided a SQL query to execute
-        if not sql_query:
-            print("Gemini did not generate a SQL query.")
-            return jsonify({"error": "Gemini could not generate a SQL query for that question or provided a direct answer."}), 400
-
-        # === Step 2: Execute SQL query on BigQuery ===
-        print("Executing BigQuery query...")
-        job = bigquery_client.query(sql_query)
-        query_results = job.result() # Waits for the job to complete
-        print("BigQuery query executed successfully.")
-
-        # Format results (using pandas for convenience)
-        results_df = query_results.to_dataframe()
-
-        # === Step 3: Send results back to Gemini for summarization (Optional but Recommended) ===
-        if not results_df.empty:
-            results_csv = results_df.to_csv(index=False)
-            summarize_prompt = f"""Based on the following data results from a BigQuery query, and the original question '{user_question}', provide a concise and clear answer to the user in Persian.
-The query results are:
+            results_df = execute_query(sql_query)
+        query_cache.put_result(sql_query, results_df)
+    trace.result_size(results_df)
+    return (results_df, table) if keep_arrow else results_df
+
+
+def summarize_prompt_for(user_question, results_df):
+    reduced = result_reducer.reduce(results_df)
+    metrics.current().set(prompt_result_bytes=reduced.prompt_bytes, result_reduced=reduced.reduced)
+    if reduced.reduced:
+        print(f"Reduced {len(results_df)} result rows for the prompt: ~{reduced.full_bytes} -> {reduced.prompt_bytes} bytes")
+        results_intro = "The query returned too many rows to list, so here is a statistical summary of all of them with some example rows"
+    else:
+        results_intro = "The query results are"
+    return f"""Based on the following data results from a BigQuery query, and the original question '{user_question}', provide a concise and clear answer to the user in Persian.
+{results_intro}:
 ---
-{results_csv}
+{reduced.text}
 ---
 """
-            print("Sending results to Gemini for summarization...")
-            final_answer_response = chat.send_message(summarize_prompt)
-            final_answer = final_answer_response.text
-            print(f"Final summarized answer from Gemini: {final_answer}")
-        else:
-            final_answer = "هیچ نتیجه‌ای برای پرسش شما یافت نشد. " + explanation if explanation else "هیچ نتیجه‌ای برای پرسش شما یافت نشد."
-            print(f"No results found: {final_answer}")
 
-        return jsonify({"answer": final_answer})
 
+def no_results_answer(explanation):
+    return f"{NO_RESULTS_ANSWER} {explanation}" if explanation else NO_RESULTS_ANSWER
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def traced_answer(user_question, session_id, request_id):
+    """answer_question for the job pool, traced under the submitting request's id."""
+    with metrics.trace("/chat/jobs", request_id):
+        return answer_question(user_question, session_id)
+
+
+def answer_question(user_question, session_id, with_rows=False):
+    """Runs the whole pipeline for one question; returns the JSON body for the client.
+
+    With `with_rows`, the body also carries the result rows under "rows" for rows_response():
+    the downloaded Arrow table when the query ran on BigQuery, otherwise the result frame.
+    """
+    init_clients()
+    session = chat_sessions.get(session_id)
+
+    # === Step 1: Ask Gemini to generate SQL ===
+    sql_query, explanation, direct_answer = generate_sql(session, user_question)
+    if direct_answer is not None:
+        return {"answer": direct_answer, "session_id": session_id}
+
+    # === Step 2: Execute SQL query on BigQuery ===
+    if with_rows:
+        results_df, table = run_query(sql_query, keep_arrow=True)
+    else:
+        results_df = run_query(sql_query)
+
+    # === Step 3: Send results back to Gemini for summarization (Optional but Recommended) ===
+    trace = metrics.current()
+    final_answer = query_cache.get_answer(user_question, sql_query)
+    trace.cache("answer", final_answer is not None)
+    if final_answer is not None:
+        print("Answer cache hit.")
+    elif (final_answer := result_reducer.template_answer(results_df)) is not None:
+        # Scalar/tiny results don't need a second Gemini round trip
+        print(f"Answered from template: {final_answer}")
+        trace.set(templated_answer=True)
+    elif not results_df.empty:
+        print("Sending results to Gemini for summarization...")
+        summarize_prompt = summarize_prompt_for(user_question, results_df)
+        with trace.stage("summarization"), gemini_limiter.slot():
+            final_answer_response = chat_sessions.send(session, summarize_prompt)
+        trace.gemini_usage("summary", final_answer_response)
+        final_answer = final_answer_response.text
+        print(f"Final summarized answer from Gemini: {final_answer}")
+        query_cache.put_answer(user_question, sql_query, final_answer)
+    else:
+        final_answer = no_results_answer(explanation)
+        print(f"No results found: {final_answer}")
+
+    body = {"answer": final_answer, "session_id": session_id}
+    if with_rows:
+        body["rows"] = table if table is not None else results_df
+    return body
+
+
+def read_format():
+    """The opt-in raw-rows format: None (answer only), "columnar" JSON or "arrow" IPC."""
+    body = request.get_json(silent=True) or {}
+    output_format = request.args.get("format") or body.get("format")
+    if output_format is not None and output_format not in results.FORMATS:
+        raise ChatError(f"Unknown format {output_format!r}; use one of {', '.join(results.FORMATS)}")
+    return output_format
+
+
+def rows_response(body, output_format):
+    """Encodes an answer_question(with_rows=True) body in the requested format."""
+    rows = body.pop("rows", None)
+    if output_format == "arrow":
+        # The answer travels in the schema metadata so one response carries everything
+        return Response(results.arrow_ipc(rows, metadata=body), mimetype=results.ARROW_MIMETYPE)
+    if rows is not None:
+        body["rows"] = results.columnar(rows)
+    return Response(results.dumps(body), mimetype="application/json")
+
+
+def overloaded_response(e):
+    response = jsonify({"error": str(e)})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
+
+def request_id():
+    return request.headers.get("X-Request-Id") or uuid.uuid4().hex
+
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    with metrics.trace("/chat", request_id()) as trace:
+        try:
+            user_question, session_id = read_chat_request()
+            output_format = read_format()
+            body = answer_question(user_question, session_id, with_rows=output_format is not None)
+            response = (rows_response(body, output_format) if output_format else jsonify(body)), 200
+
+        except ChatError as e:
+            trace.set(outcome="rejected", error=str(e))
+            response = jsonify({"error": str(e)}), e.status
+        except jobs.Overloaded as e:
+            trace.set(outcome="overloaded")
+            response = overloaded_response(e)
+        except Exception as e:
+            print(f"Error during /ask: {e}")
+            trace.set(outcome="error", error=str(e))
+            # This will now reliably return JSON errors to the frontend
+            response = jsonify({"error": str(e)}), 500
+    response[0].headers["X-Request-Id"] = trace.request_id
+    return response
+
+@app.route("/chat/jobs", methods=["POST"])
+def submit_chat_job():
+    """Queues a question and returns immediately; poll the returned status_url for the answer."""
+    try:
+        user_question, session_id = read_chat_request()
+        job = chat_jobs.submit(traced_answer, user_question, session_id, request_id())
+    except ChatError as e:
+        return jsonify({"error": str(e)}), e.status
+    except jobs.Overloaded as e:
+        return overloaded_response(e)
+
+    status_url = f"/chat/jobs/{job.id}"
+    response = jsonify({"job_id": job.id, "session_id": session_id, "status_url": status_url})
+    response.headers["Location"] = status_url
+    return response, 202
+
+@app.route("/chat/jobs/<job_id>")
+def chat_job_status(job_id):
+    """Returns the job's status, plus the answer once it is done."""
+    job = chat_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    response = jsonify(job.to_dict())
+    if job.status in ("queued", "running"):
+        response.headers["Retry-After"] = "1"
+    return response, 200
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Same pipeline as /chat, but as Server-Sent Events so the answer renders while it is generated.
+
+    Events: session, sql_generated, query_running, rows_ready, answer_chunk, done, error.
+    """
+    try:
+        user_question, session_id = read_chat_request()
+    except ChatError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    stream_request_id = request_id()
+
+    def events():
+        with metrics.trace("/chat/stream", stream_request_id) as trace:
+            yield from traced_events(trace)
+
+    def traced_events(trace):
+        try:
+            yield sse_event("session", {"session_id": session_id, "request_id": trace.request_id})
+            init_clients()
+            session = chat_sessions.get(session_id)
+
+            sql_query, explanation, direct_answer = generate_sql(session, user_question)
+            if direct_answer is not None:
+                yield sse_event("done", {"answer": direct_answer})
+                return
+            yield sse_event("sql_generated", {"sql": sql_query, "explanation": explanation})
+
+            results_df = query_cache.get_result(sql_query)
+            trace.cache("result", results_df is not None)
+            if results_df is not None:
+                stats = {"cached": True}
+            elif (results_df := run_local(sql_query)) is not None:
+                stats = {"engine": "local"}
+            else:
+                with bigquery_limiter.slot():
+                    job = start_query(sql_query)
+                    yield sse_event("query_running", job_stats(job))
+                    results_df = fetch_results(job)
+                stats = job_stats(job)
+            if "cached" not in stats:
+                query_cache.put_result(sql_query, results_df)
+            trace.result_size(results_df)
+            yield sse_event("rows_ready", {"row_count": len(results_df), "columns": list(results_df.columns), **stats})
+
+            final_answer = query_cache.get_answer(user_question, sql_query)
+            trace.cache("answer", final_answer is not None)
+            if final_answer is None:
+                final_answer = result_reducer.template_answer(results_df)
+            if final_answer is None and not results_df.empty:
+                chunks = []
+                summarize_prompt = summarize_prompt_for(user_question, results_df)
+                with trace.stage("summarization"), gemini_limiter.slot():
+                    chunk = None
+                    for chunk in chat_sessions.stream(session, summarize_prompt):
+                        chunks.append(chunk.text)
+                        yield sse_event("answer_chunk", {"text": chunk.text})
+                # The last chunk carries the token totals for the whole answer
+                trace.gemini_usage("summary", chunk)
+                final_answer = "".join(chunks)
+                query_cache.put_answer(user_question, sql_query, final_answer)
+            elif final_answer is None:
+                final_answer = no_results_answer(explanation)
+            yield sse_event("done", {"answer": final_answer})
+
+        except jobs.Overloaded as e:
+            trace.set(outcome="overloaded")
+            yield sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"Error during /chat/stream: {e}")
+            trace.set(outcome="rejected" if isinstance(e, ChatError) else "error", error=str(e))
+            yield sse_event("error", {"error": str(e)})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Request-Id": stream_request_id}
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers=headers)
+
+@app.route("/api/charts_data")
+def charts_data():
+    """Returns the pre-aggregated dashboard data as compact columnar JSON, with ETag/gzip support."""
+    try:
+        snapshot = charts_service.get()
     except Exception as e:
-        print(f"Error during /ask: {e}")
-        # This will now reliably return JSON errors to the frontend
-        return jsonify({"error": str(e)}), 500
+        print(f"Error computing charts data: {e}")
+        return jsonify({"error": str(e)}), 503
+
+    # Honors q-values: "gzip;q=0" means the client refuses gzip
+    gzipped = request.accept_encodings["gzip"] > 0
+    response = Response(snapshot.gzip_body if gzipped else snapshot.body, mimetype="application/json")
+    if gzipped:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    # Different bytes need different tags, otherwise caches could mix the encodings up
+    response.set_etag(snapshot.etag + ("-gzip" if gzipped else ""))
+    response.last_modified = snapshot.last_modified
+    return response.make_conditional(request)
+
+@app.route("/chat/<session_id>", methods=["DELETE"])
+def end_chat_session(session_id):
+    """Forgets a client's conversation history."""
+    if not chat_sessions.drop(session_id):
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify({"status": "Session closed"}), 200
+
+# Warm the clients in the background so the first user doesn't pay for it
+if os.environ.get("CHAT_WARMUP", "1") == "1":
+    threading.Thread(target=warm_up, daemon=True).start()
+
+def replica_bigquery_client():
+    init_clients()
+    return bigquery_client
+
+if os.environ.get("CHARTS_REFRESH", "1") == "1":
+    charts_service.start_refresh_loop()
+
+# Keep the local replica fresh; in "local" mode there is no BigQuery to refresh from
+if QUERY_ENGINE == "auto":
+    local_replica.start_refresh_loop(replica_bigquery_client, int(os.environ.get("LOCAL_REPLICA_CHECK_INTERVAL", "600")))
 
 # === LOCAL DEBUG ===
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+"""Per-request tracing of the chat pipeline, exported as Prometheus text and JSON log lines.
+
+Every request gets a Trace that times each stage and collects attributes (BigQuery job
+stats, Gemini token counts, result sizes, cache outcomes). Stage timings also feed
+process-wide histograms rendered at /metrics. Metrics are per process: with several
+gunicorn workers, scrape each worker or sum them in the query.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000, 1_000_000_000)
+
+trace_log = logging.getLogger("refah.trace")
+if not trace_log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_log.addHandler(_handler)
+    trace_log.setLevel(logging.INFO)
+    trace_log.propagate = False
+
+
+def _labels_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    labels = _labels_text(self.labels + ("le",), key + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _labels_text(self.labels + ("le",), key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                lines.append(f"{self.name}_sum{_labels_text(self.labels, key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_labels_text(self.labels, key)} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # (prefix, callable returning {name: value} at scrape time, names of monotonic counts)
+        self.stats_sources = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def stats(self, prefix, source, counters=()):
+        """Exports a component's stats() dict: `counters` as <prefix>_<name>_total, the rest as gauges."""
+        self.stats_sources.append((prefix, source, frozenset(counters)))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, source, counters in self.stats_sources:
+            for name, value in source().items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                if name in counters:
+                    lines.append(f"# TYPE {prefix}_{name}_total counter")
+                    lines.append(f"{prefix}_{name}_total {value}")
+                else:
+                    lines.append(f"# TYPE {prefix}_{name} gauge")
+                    lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+request_seconds = registry.histogram(
+    "chat_request_seconds", "End-to-end request latency.", labels=("route", "outcome"))
+stage_seconds = registry.histogram(
+    "chat_stage_seconds", "Latency of each chat pipeline stage.", labels=("stage",))
+bigquery_bytes = registry.counter(
+    "bigquery_bytes_processed_total", "Bytes processed by BigQuery jobs.")
+bigquery_slot_ms = registry.counter(
+    "bigquery_slot_milliseconds_total", "Slot milliseconds consumed by BigQuery jobs.")
+bigquery_jobs = registry.counter(
+    "bigquery_jobs_total", "BigQuery jobs by whether BigQuery served them from its cache.", labels=("cache_hit",))
+gemini_tokens = registry.counter(
+    "gemini_tokens_total", "Gemini tokens used.", labels=("call", "kind"))
+result_rows = registry.histogram(
+    "chat_result_rows", "Rows returned by the query.", buckets=SIZE_BUCKETS)
+result_bytes = registry.histogram(
+    "chat_result_bytes", "In-memory size of the query result.", buckets=SIZE_BUCKETS)
+cache_outcomes = registry.counter(
+    "chat_cache_lookups_total", "Cache lookups by tier and outcome.", labels=("tier", "outcome"))
+
+
+class Trace:
+    def __init__(self, route, request_id=None):
+        self.route = route
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.attributes = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            # A stage may run twice (e.g. SQL regeneration); report the total
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            stage_seconds.observe(elapsed, stage=name)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def cache(self, tier, hit):
+        outcome = "hit" if hit else "miss"
+        self.attributes[f"{tier}_cache"] = outcome
+        cache_outcomes.inc(tier=tier, outcome=outcome)
+
+    def bigquery_job(self, job):
+        stats = {
+            "bq_job_id": job.job_id,
+            "bq_bytes_processed": job.total_bytes_processed or 0,
+            "bq_slot_ms": job.slot_millis or 0,
+            "bq_cache_hit": bool(job.cache_hit),
+        }
+        if job.created and job.started:
+            stats["bq_queued_s"] = round((job.started - job.created).total_seconds(), 3)
+        if job.started and job.ended:
+            stats["bq_running_s"] = round((job.ended - job.started).total_seconds(), 3)
+        self.set(**stats)
+        # BigQuery's own timestamps split the wait into queueing and execution
+        if "bq_queued_s" in stats:
+            stage_seconds.observe(stats["bq_queued_s"], stage="bigquery_queued")
+        if "bq_running_s" in stats:
+            stage_seconds.observe(stats["bq_running_s"], stage="bigquery_running")
+        bigquery_bytes.inc(stats["bq_bytes_processed"])
+        bigquery_slot_ms.inc(stats["bq_slot_ms"])
+        bigquery_jobs.inc(cache_hit=str(stats["bq_cache_hit"]).lower())
+
+    def gemini_usage(self, call, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        prompt, output = usage.prompt_token_count, usage.candidates_token_count
+        self.set(**{f"gemini_{call}_prompt_tokens": prompt, f"gemini_{call}_output_tokens": output})
+        gemini_tokens.inc(prompt, call=call, kind="prompt")
+        gemini_tokens.inc(output, call=call, kind="output")
+
+    def result_size(self, results_df):
+        rows = len(results_df)
+        size = int(results_df.memory_usage(deep=True).sum())
+        self.set(result_rows=rows, result_bytes=size)
+        result_rows.observe(rows)
+        result_bytes.observe(size)
+
+    def finish(self, outcome):
+        elapsed = time.perf_counter() - self.started
+        request_seconds.observe(elapsed, route=self.route, outcome=outcome)
+        trace_log.info(json.dumps({
+            "event": "chat_trace",
+            "request_id": self.request_id,
+            "route": self.route,
+            "outcome": outcome,
+            "duration_s": round(elapsed, 4),
+            "stages_s": {name: round(value, 4) for name, value in self.stages.items()},
+            **self.attributes,
+        }, ensure_ascii=False, default=str))
+
+
+class _NoTrace(Trace):
+    """Stand-in used outside of a traced request; records process metrics only."""
+
+    def __init__(self):
+        super().__init__("untraced", request_id="-")
+
+    def finish(self, outcome):
+        pass
+
+
+_local = threading.local()
+
+
+def current():
+    return getattr(_local, "trace", None) or _NoTrace()
+
+
+@contextmanager
+def trace(route, request_id=None):
+    """Makes a Trace current for this thread and logs it when the block ends."""
+    active = Trace(route, request_id)
+    previous = getattr(_local, "trace", None)
+    _local.trace = active
+    outcome = "ok"
+    try:
+        yield active
+    except GeneratorExit:
+        # A streaming client went away mid-response
+        outcome = "disconnected"
+        raise
+    except Exception as e:
+        outcome = "error"
+        active.set(error=str(e))
+        raise
+    finally:
+        _local.trace = previous
+        active.finish(active.attributes.pop("outcome", outcome))
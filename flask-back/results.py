@@ -0,0 +1,99 @@
+"""Lean query-result handling: Arrow downloads with a row cap, and raw-row encodings for clients.
+
+Rows are streamed from BigQuery as Arrow record batches (over the Storage Read API when the
+package is installed and BigQuery thinks it's worth it, otherwise the REST pages), and the
+download stops once the cap is reached. The Arrow table converts to pandas in one copy without
+the db-dtypes round trip, and raw rows go to clients as columnar JSON (orjson when available)
+or an Arrow IPC stream. Rows fresh from BigQuery are encoded from the downloaded Arrow table;
+rows from the result cache or the local replica are dataframes and convert back to Arrow once.
+"""
+import json
+import os
+
+import pyarrow as pa
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is slower but produces the same JSON
+    orjson = None
+
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+# Values of the opt-in `format` parameter
+FORMATS = ("columnar", "arrow")
+
+
+def storage_client():
+    """A BigQuery Storage read client, or None when disabled or not installed."""
+    if os.environ.get("BIGQUERY_STORAGE_API", "1") != "1":
+        return None
+    try:
+        from google.cloud import bigquery_storage
+    except ImportError:
+        return None
+    return bigquery_storage.BigQueryReadClient()
+
+
+def read_arrow(row_iterator, max_rows=None, bqstorage_client=None):
+    """Downloads at most `max_rows` rows; returns (table, truncated)."""
+    batches = []
+    rows = 0
+    truncated = False
+    for batch in row_iterator.to_arrow_iterable(bqstorage_client=bqstorage_client):
+        if max_rows is not None and rows + batch.num_rows > max_rows:
+            batches.append(batch.slice(0, max_rows - rows))
+            truncated = True
+            # Leaving the loop closes the iterator, so no further pages are downloaded
+            break
+        batches.append(batch)
+        rows += batch.num_rows
+    if not batches:
+        return pa.table({}), False
+    return pa.Table.from_batches(batches), truncated
+
+
+def to_frame(table, self_destruct=True):
+    """Converts to pandas; by default Arrow buffers are freed as it goes and the table is unusable afterwards."""
+    return table.to_pandas(split_blocks=True, self_destruct=self_destruct)
+
+
+def as_table(data):
+    """Accepts an Arrow table or a dataframe (e.g. from the result cache or the local engine)."""
+    if data is None:
+        # A direct answer has no rows
+        return pa.table({})
+    if isinstance(data, pa.Table):
+        return data
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+
+def _default(value):
+    # Decimals (NUMERIC columns) and anything else orjson/json can't encode natively
+    return str(value)
+
+
+def dumps(payload):
+    """Compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def columnar(data):
+    """{"columns": [...], "data": {column: [values]}} for a table or dataframe."""
+    table = as_table(data)
+    return {"columns": table.column_names, "row_count": table.num_rows, "data": table.to_pydict()}
+
+
+def arrow_ipc(data, metadata=None):
+    """An Arrow IPC stream; `metadata` (str -> str) is attached to the schema."""
+    table = as_table(data)
+    if metadata:
+        existing = table.schema.metadata or {}
+        table = table.replace_schema_metadata({
+            **existing,
+            **{key.encode("utf-8"): str(value).encode("utf-8") for key, value in metadata.items()},
+        })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
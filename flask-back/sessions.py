@@ -0,0 +1,196 @@
+"""Per-client Gemini chat sessions with bounded history, idle eviction and a live-session cap.
+
+Gunicorn workers are separate processes, so the bounded history of each session is kept in a
+history store: the SQLite store (the default) is shared by every worker on the host, and each
+turn starts from the stored history, so a follow-up (or a /chat/jobs poll's job) that lands on
+another worker keeps its context. The memory store only works with one process
+(gunicorn -w 1 --threads N) or with routing that pins a session to one worker.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+MAX_SESSION_ID_LENGTH = 128
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "chat_sessions.sqlite3")
+
+
+def _message(content):
+    """A history entry as plain JSON, {"role": ..., "parts": [text, ...]}."""
+    if isinstance(content, dict):
+        return {"role": content["role"], "parts": [str(part) for part in content["parts"]]}
+    return {"role": content.role, "parts": [part.text for part in content.parts]}
+
+
+class SQLiteHistoryStore:
+    """Session histories in a SQLite file, visible to every worker process on the host."""
+
+    def __init__(self, path, idle_ttl):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS chat_sessions (id TEXT PRIMARY KEY, history TEXT, updated_at REAL)")
+
+    def _connect(self):
+        # One short-lived connection per call keeps this safe across threads and forks
+        return sqlite3.connect(self.path, timeout=5)
+
+    def load(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT history FROM chat_sessions WHERE id = ? AND updated_at >= ?",
+                               (session_id, time.time() - self.idle_ttl)).fetchone()
+        return json.loads(row[0]) if row is not None else []
+
+    def save(self, session_id, history):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO chat_sessions VALUES (?, ?, ?)",
+                         (session_id, json.dumps(history, ensure_ascii=False), now))
+            conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (now - self.idle_ttl,))
+
+    def drop(self, session_id):
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+
+class Session:
+    """One client's Gemini conversation; its lock serializes that client's turns in this process."""
+
+    def __init__(self, session_id, chat):
+        self.id = session_id
+        self.chat = chat
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class SessionManager:
+    def __init__(self, start_chat, max_sessions, idle_ttl, history_turns, store=None):
+        self.start_chat = start_chat
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # Each turn is a user message plus a model reply
+        self.history_messages = history_turns * 2
+        # None keeps histories in this process only
+        self.store = store
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    def get(self, session_id):
+        """Returns the session for `session_id`, creating it (and evicting others) as needed."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                while len(self._sessions) >= self.max_sessions:
+                    evicted_id, _ = self._sessions.popitem(last=False)
+                    print(f"Evicted least recently used chat session {evicted_id}")
+                session = Session(session_id, self.start_chat())
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            session.last_used = now
+            return session
+
+    def _evict_idle(self, now):
+        # Sessions are kept in last-used order, so stale ones are always at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.idle_ttl:
+                break
+            del self._sessions[session_id]
+
+    def _load(self, session):
+        # Another worker may have answered this session's previous turns
+        if self.store is not None:
+            session.chat.history = self.store.load(session.id)
+
+    def _save(self, session):
+        if self.store is not None:
+            history = session.chat.history[-self.history_messages:]
+            self.store.save(session.id, [_message(content) for content in history])
+
+    def trim(self, session):
+        """Drops the oldest turns so prompts stop growing with the conversation."""
+        history = session.chat.history
+        if len(history) > self.history_messages:
+            session.chat.history = history[-self.history_messages:]
+
+    def is_fresh(self, session):
+        """True until the session's first turn, i.e. while its questions can't depend on context."""
+        with session.lock:
+            self._load(session)
+            return not session.chat.history
+
+    def record(self, session, content, reply):
+        """Adds a turn answered without Gemini (e.g. from the cache) so follow-ups can refer to it."""
+        with session.lock:
+            self._load(session)
+            session.chat.history = [
+                *session.chat.history,
+                {"role": "user", "parts": [content]},
+                {"role": "model", "parts": [reply]},
+            ]
+            self._save(session)
+
+    def send(self, session, content, **kwargs):
+        with session.lock:
+            self._load(session)
+            self.trim(session)
+            response = session.chat.send_message(content, **kwargs)
+            self._save(session)
+            return response
+
+    def stream(self, session, content, **kwargs):
+        """Yields the reply chunk by chunk; the session stays locked until the stream ends."""
+        with session.lock:
+            self._load(session)
+            self.trim(session)
+            response = session.chat.send_message(content, stream=True, **kwargs)
+            try:
+                for chunk in response:
+                    yield chunk
+            except BaseException:
+                # The client went away or the stream broke (network error, SAFETY stop...).
+                # Forget the half-finished turn: a broken last response makes every later
+                # history read raise, which would fail the session until it is evicted.
+                session.chat.rewind()
+                raise
+            self._save(session)
+
+    def drop(self, session_id):
+        with self._lock:
+            dropped = self._sessions.pop(session_id, None) is not None
+        if self.store is not None:
+            dropped = self.store.drop(session_id) or dropped
+        return dropped
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+def from_env(start_chat):
+    """Builds the manager from CHAT_SESSION_* environment variables."""
+    idle_ttl = int(os.environ.get("CHAT_SESSION_IDLE_TTL", "1800"))
+    kind = os.environ.get("CHAT_SESSION_STORE", "sqlite")
+    if kind == "sqlite":
+        store = SQLiteHistoryStore(os.environ.get("CHAT_SESSION_STORE_PATH", DEFAULT_STORE_PATH), idle_ttl)
+    elif kind == "memory":
+        store = None
+    else:
+        raise ValueError(f"Unknown session store: {kind!r}")
+    return SessionManager(
+        start_chat,
+        max_sessions=int(os.environ.get("CHAT_SESSION_MAX", "200")),
+        idle_ttl=idle_ttl,
+        history_turns=int(os.environ.get("CHAT_SESSION_HISTORY_TURNS", "6")),
+        store=store,
+    )
@@ -0,0 +1,206 @@
+"""Pre-execution checks for Gemini-generated SQL.
+
+Only single read-only SELECT statements over the Refah table get through, the row count is
+capped with an injected/clamped LIMIT, and a BigQuery dry run rejects queries that would scan
+more than the byte budget before any slot time is spent.
+"""
+import os
+import re
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud import bigquery
+
+
+class SqlRejected(Exception):
+    """The query failed a guard check; the message is phrased so Gemini can fix the query."""
+
+
+# One left-to-right scan: whichever of a literal, a quoted identifier or a comment starts first
+# wins, so a '#' inside a string is not a comment and a quote inside a comment is not a string
+_TOKENS = re.compile(
+    r"(?P<literal>'''.*?'''|\"\"\".*?\"\"\"|'(?:[^'\\\n]|\\.)*'|\"(?:[^\"\\\n]|\\.)*\")"
+    r"|(?P<identifier>`[^`]*`)"
+    r"|(?P<comment>--[^\n]*|#[^\n]*|/\*.*?\*/)",
+    re.S,
+)
+_FORBIDDEN = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|DROP|ALTER|TRUNCATE|GRANT|REVOKE|CALL|EXECUTE|"
+    r"DECLARE|SET|EXPORT|LOAD|BEGIN|COMMIT|ROLLBACK)\b",
+    re.I,
+)
+_FROM_OR_JOIN = re.compile(r"\b(?:FROM|JOIN)\b", re.I)
+# FROM inside expressions, not a table reference
+_NOT_TABLE_FROM = re.compile(r"\bEXTRACT\s*\(\s*\w+\s+FROM\b|\bIS\s+(?:NOT\s+)?DISTINCT\s+FROM\b", re.I)
+_SUBQUERY = re.compile(r"\s*(?:SELECT|WITH)\b", re.I)
+_NAME = re.compile(r"\s*((?:`[^`]+`|[\w-]+)(?:\s*\.\s*(?:`[^`]+`|[\w-]+))*)")
+_ALIAS = re.compile(r"\s*(?:AS\s+)?(`[^`]+`|\w+)", re.I)
+_WITH_OFFSET = re.compile(r"\s*WITH\s+OFFSET(?:\s+(?:AS\s+)?\w+)?", re.I)
+# Words that can follow a FROM item, so they are never its alias
+_CLAUSE_WORDS = {
+    "where", "group", "order", "limit", "having", "qualify", "window", "union", "except", "intersect",
+    "join", "inner", "left", "right", "full", "cross", "on", "using", "for", "tablesample", "pivot",
+    "unpivot", "with",
+}
+_CTE_NAMES = re.compile(r"(?:\bWITH(?:\s+RECURSIVE)?|,)\s*(\w+)\s+AS\s*\(", re.I)
+_TRAILING_LIMIT = re.compile(r"\bLIMIT\s+(\d+)(\s+OFFSET\s+\d+)?\s*$", re.I)
+
+
+class SqlGuard:
+    def __init__(self, full_table_id, max_rows, max_bytes_billed, timeout):
+        self.max_rows = max_rows
+        self.max_bytes_billed = max_bytes_billed
+        self.timeout = timeout
+        _, dataset, table = full_table_id.split(".")
+        self.full_table_id = full_table_id
+        self.allowed_tables = {name.lower() for name in (full_table_id, f"{dataset}.{table}", table)}
+
+    def check(self, sql):
+        """Static checks; returns the query with its LIMIT injected or clamped."""
+        sql = sql.strip().rstrip(";").strip()
+        # Only look at code: literals and comments may legitimately contain anything
+        code = _code(sql)
+        if not code.strip():
+            raise SqlRejected("The query is empty.")
+        if "'" in code or '"' in code:
+            raise SqlRejected("The query has an unterminated string literal.")
+        if ";" in code:
+            raise SqlRejected("Only a single SQL statement is allowed.")
+        if not re.match(r"\s*(SELECT|WITH)\b", code, re.I):
+            raise SqlRejected("Only SELECT queries are allowed.")
+        forbidden = _FORBIDDEN.search(code)
+        if forbidden:
+            raise SqlRejected(f"{forbidden.group(1).upper()} statements are not allowed; only read-only SELECT queries.")
+
+        ctes = {name.lower() for name in _CTE_NAMES.findall(code)}
+        for name in _from_items(code):
+            if name not in self.allowed_tables and name not in ctes:
+                raise SqlRejected(f"The query reads from `{name}`; only `{self.full_table_id}` may be queried.")
+
+        return self.limit(sql, code)
+
+    def limit(self, sql, code):
+        match = _TRAILING_LIMIT.search(code)
+        if match is None:
+            return f"{sql}\nLIMIT {self.max_rows}"
+        if int(match.group(1)) <= self.max_rows:
+            return sql
+        # The code and the original end the same way (a trailing LIMIT has no literals or comments)
+        original = _TRAILING_LIMIT.search(sql)
+        if original is None:
+            # Newlines keep a trailing line comment from swallowing the wrapper
+            return f"SELECT * FROM (\n{sql}\n) LIMIT {self.max_rows}"
+        return f"{sql[:original.start()]}LIMIT {self.max_rows}{original.group(2) or ''}"
+
+    def dry_run(self, bigquery_client, sql):
+        """Returns the bytes the query would process; rejects invalid or too expensive queries."""
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        try:
+            job = bigquery_client.query(sql, job_config=job_config)
+        except google_exceptions.BadRequest as e:
+            raise SqlRejected(f"BigQuery rejected the query: {e.message}") from e
+        # BigQuery's own list of what the query reads catches anything the static parse missed
+        for ref in job.referenced_tables or []:
+            name = f"{ref.project}.{ref.dataset_id}.{ref.table_id}"
+            if name.lower() != self.full_table_id.lower():
+                raise SqlRejected(f"The query reads from `{name}`; only `{self.full_table_id}` may be queried.")
+        estimated = job.total_bytes_processed or 0
+        if estimated > self.max_bytes_billed:
+            raise SqlRejected(
+                f"The query would scan {estimated:,} bytes, over the {self.max_bytes_billed:,} byte limit. "
+                "Select fewer columns or aggregate instead of returning raw rows."
+            )
+        return estimated
+
+    def job_config(self):
+        """Config for the real run: BigQuery itself refuses to bill more, or run longer, than allowed."""
+        return bigquery.QueryJobConfig(
+            maximum_bytes_billed=self.max_bytes_billed,
+            job_timeout_ms=int(self.timeout * 1000),
+        )
+
+
+def _code(sql):
+    """The query with literals emptied and comments removed; quoted identifiers are kept."""
+    def replace(match):
+        if match.group("literal") is not None:
+            # Any quote left in the code afterwards belongs to an unterminated literal
+            return "0"
+        if match.group("comment") is not None:
+            return " "
+        return match.group(0)
+
+    return _TOKENS.sub(replace, sql)
+
+
+def _skip_parens(code, pos):
+    """Position just after the parenthesized group starting at `pos`."""
+    depth = 0
+    for i in range(pos, len(code)):
+        if code[i] == "(":
+            depth += 1
+        elif code[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return len(code)
+
+
+def _from_items(code):
+    """Lower-cased names of every table read in FROM/JOIN clauses, including comma joins.
+
+    Subqueries are skipped here (their own FROM is visited separately), other parenthesized
+    items are read as FROM items themselves, and UNNEST(...) reads no table; any other
+    function call or statement keyword in a FROM clause is returned by name.
+    """
+    code = _NOT_TABLE_FROM.sub(" ", code)
+    names = []
+    for match in _FROM_OR_JOIN.finditer(code):
+        pos = match.end()
+        while True:
+            while pos < len(code) and code[pos].isspace():
+                pos += 1
+            if code.startswith("(", pos):
+                end = _skip_parens(code, pos)
+                inner = code[pos + 1:end - 1]
+                # Anything but a subquery is itself a FROM item list, e.g. (a JOIN b ON ...), or
+                # a DuckDB table statement like (PIVOT read_text(...) ...) that must not get through
+                if not _SUBQUERY.match(inner):
+                    names.extend(_from_items(f"FROM {inner}"))
+                pos = end
+            else:
+                name = _NAME.match(code, pos)
+                if name is None:
+                    break
+                pos = name.end()
+                rest = code[pos:].lstrip()
+                if rest.startswith("("):
+                    pos = _skip_parens(code, code.index("(", pos))
+                    if name.group(1).lower() != "unnest":
+                        names.append(re.sub(r"[`\s]", "", name.group(1)).lower())
+                else:
+                    names.append(re.sub(r"[`\s]", "", name.group(1)).lower())
+            offset = _WITH_OFFSET.match(code, pos)
+            if offset:
+                pos = offset.end()
+            alias = _ALIAS.match(code, pos)
+            if alias and alias.group(1).lower() not in _CLAUSE_WORDS:
+                pos = alias.end()
+            offset = _WITH_OFFSET.match(code, pos)
+            if offset:
+                pos = offset.end()
+            # A comma after the item means another table in the same FROM clause
+            comma = re.match(r"\s*,", code[pos:])
+            if comma is None:
+                break
+            pos += comma.end()
+    return names
+
+
+def from_env(full_table_id):
+    """Builds the guard from SQL_* environment variables."""
+    return SqlGuard(
+        full_table_id,
+        max_rows=int(os.environ.get("SQL_MAX_ROWS", "1000")),
+        max_bytes_billed=int(os.environ.get("SQL_MAX_BYTES_BILLED", str(1024 ** 3))),
+        timeout=float(os.environ.get("SQL_QUERY_TIMEOUT", "60")),
+    )
@@ -0,0 +1,160 @@
+"""Shrinks BigQuery results before they go into the summarization prompt.
+
+Small results are passed through as CSV like before. Larger ones are replaced by a compact
+typed summary (per-column aggregates, top rows and a sample), and scalar or tiny results
+skip the second Gemini call entirely with a templated Persian answer.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Rough chars-per-token ratio, only used to report how many prompt tokens were saved
+CHARS_PER_TOKEN = 4
+
+
+class ReducedResult:
+    def __init__(self, text, reduced, full_bytes, prompt_bytes):
+        self.text = text
+        self.reduced = reduced
+        self.full_bytes = full_bytes
+        self.prompt_bytes = prompt_bytes
+
+
+class ResultReducer:
+    def __init__(self, max_rows, max_bytes, top_k, sample_rows, template_max_cells):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.top_k = top_k
+        self.sample_rows = sample_rows
+        self.template_max_cells = template_max_cells
+        self._lock = threading.Lock()
+        self.counters = {
+            "results": 0, "reduced": 0, "templated": 0,
+            "full_bytes": 0, "prompt_bytes": 0, "bytes_saved": 0,
+        }
+
+    def _record(self, **deltas):
+        with self._lock:
+            for name, value in deltas.items():
+                self.counters[name] += value
+
+    # === TEMPLATE ANSWERS ===
+
+    def template_answer(self, results_df):
+        """Returns a ready Persian answer for scalar/tiny results, or None if Gemini should summarize."""
+        if results_df.empty or results_df.size > self.template_max_cells:
+            return None
+        if results_df.shape == (1, 1):
+            column = results_df.columns[0]
+            answer = f"نتیجه: {column} = {format_value(results_df.iat[0, 0])}"
+        else:
+            lines = [
+                "، ".join(f"{column}: {format_value(value)}" for column, value in row.items())
+                for _, row in results_df.iterrows()
+            ]
+            answer = "نتایج:\n" + "\n".join(f"- {line}" for line in lines)
+        full_bytes = estimate_csv_bytes(results_df)
+        self._record(results=1, templated=1, full_bytes=full_bytes, bytes_saved=full_bytes)
+        return answer
+
+    # === PROMPT REDUCTION ===
+
+    def reduce(self, results_df):
+        full_bytes = estimate_csv_bytes(results_df)
+        if len(results_df) <= self.max_rows and full_bytes <= self.max_bytes:
+            text = results_df.to_csv(index=False)
+            reduced = False
+        else:
+            text = self.describe(results_df)
+            reduced = True
+        prompt_bytes = len(text.encode("utf-8"))
+        self._record(results=1, reduced=int(reduced), full_bytes=full_bytes, prompt_bytes=prompt_bytes,
+                     bytes_saved=max(full_bytes - prompt_bytes, 0))
+        return ReducedResult(text, reduced, full_bytes, prompt_bytes)
+
+    def describe(self, results_df):
+        """Compact typed summary of a large frame: shape, per-column aggregates, top and sample rows."""
+        sections = [f"Total rows: {len(results_df)}, columns: {results_df.shape[1]}"]
+
+        numeric = results_df.select_dtypes(include="number")
+        if not numeric.empty:
+            stats = numeric.agg(["count", "mean", "std", "min", "max"]).T
+            quantiles = numeric.quantile([0.25, 0.5, 0.75]).T
+            quantiles.columns = ["p25", "p50", "p75"]
+            stats = pd.concat([stats, quantiles], axis=1)
+            stats.insert(0, "dtype", numeric.dtypes.astype(str))
+            stats.insert(2, "nulls", numeric.isna().sum())
+            sections.append("Numeric columns:\n" + stats.round(3).to_csv())
+
+        other = results_df.drop(columns=numeric.columns)
+        if not other.empty:
+            lines = []
+            for column in other.columns:
+                values = _hashable(other[column])
+                top = values.value_counts(dropna=True).head(self.top_k)
+                top_text = "; ".join(f"{value}={count}" for value, count in top.items())
+                lines.append(f"{column} ({values.dtype}): distinct={values.nunique()}, "
+                             f"nulls={int(values.isna().sum())}, top: {top_text}")
+            sections.append("Other columns:\n" + "\n".join(lines))
+
+        sections.append(f"First {min(self.top_k, len(results_df))} rows:\n"
+                        + results_df.head(self.top_k).to_csv(index=False))
+        rest = results_df.iloc[self.top_k:]
+        if not rest.empty and self.sample_rows:
+            sample = rest.sample(n=min(self.sample_rows, len(rest)), random_state=0).sort_index()
+            sections.append(f"Random sample of {len(sample)} other rows:\n" + sample.to_csv(index=False))
+        return "\n".join(sections)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["estimated_tokens_saved"] = stats["bytes_saved"] // CHARS_PER_TOKEN
+        return stats
+
+
+def _hashable(values):
+    """ARRAY/STRUCT cells (arrays, lists, dicts) can't be counted as-is; compare them as text."""
+    if values.dtype != object:
+        return values
+    try:
+        values.map(hash)
+    except TypeError:
+        return values.where(values.isna(), values.astype(str))
+    return values
+
+
+def estimate_csv_bytes(results_df, probe_rows=200):
+    """CSV size of the frame, extrapolated from the first rows so big results are never fully rendered."""
+    if results_df.empty:
+        return 0
+    probe = results_df.head(probe_rows).to_csv(index=False).encode("utf-8")
+    header, _, body = probe.partition(b"\n")
+    per_row = len(body) / min(len(results_df), probe_rows)
+    return int(len(header) + 1 + per_row * len(results_df))
+
+
+def format_value(value):
+    if isinstance(value, (bool, np.bool_)):
+        return "بله" if value else "خیر"
+    if isinstance(value, (int, np.integer)):
+        return f"{int(value):,}"
+    if isinstance(value, (float, np.floating)):
+        if pd.isna(value):
+            return "-"
+        return f"{value:,.0f}" if float(value).is_integer() else f"{value:,.2f}"
+    if value is None or value is pd.NA:
+        return "-"
+    return str(value)
+
+
+def from_env():
+    """Builds the reducer from CHAT_SUMMARY_* environment variables."""
+    return ResultReducer(
+        max_rows=int(os.environ.get("CHAT_SUMMARY_MAX_ROWS", "50")),
+        max_bytes=int(os.environ.get("CHAT_SUMMARY_MAX_BYTES", str(16 * 1024))),
+        top_k=int(os.environ.get("CHAT_SUMMARY_TOP_K", "10")),
+        sample_rows=int(os.environ.get("CHAT_SUMMARY_SAMPLE_ROWS", "10")),
+        template_max_cells=int(os.environ.get("CHAT_SUMMARY_TEMPLATE_MAX_CELLS", "4")),
+    )
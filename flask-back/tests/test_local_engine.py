@@ -0,0 +1,37 @@
+import pyarrow as pa
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from local_engine import LocalReplica
+
+FROM_TABLE = "FROM `gemini-web-agent-466416.Refah_CSV.table_CSV_Mapped_1000`"
+
+
+@pytest.fixture
+def replica(tmp_path):
+    path = tmp_path / "refah.parquet"
+    pq.write_table(pa.table({"ostan": ["a", None, "b"], "age": [30, 40, None]}), path)
+    return LocalReplica(str(path), "gemini-web-agent-466416", "Refah_CSV", "table_CSV_Mapped_1000", max_age=3600)
+
+
+def test_queries_the_replica(replica):
+    results_df = replica.query(f"SELECT ostan {FROM_TABLE} ORDER BY ostan")
+    assert results_df["ostan"].tolist() == [None, "a", "b"]
+
+
+@pytest.mark.parametrize("sql", [
+    f"SELECT p.* {FROM_TABLE} t, (PIVOT read_text('/etc/passwd') ON filename USING first(content)) p",
+    f"SELECT t.ostan, f.content {FROM_TABLE} t, read_text('/etc/passwd') f",
+])
+def test_cannot_read_other_files(replica, sql):
+    assert replica.query(sql) is None
+    # The connection is still usable, and still locked down
+    assert replica.query(f"SELECT COUNT(*) AS n {FROM_TABLE}")["n"].tolist() == [3]
+
+
+def test_configuration_is_locked(replica):
+    replica.query(f"SELECT 1 {FROM_TABLE}")
+    with pytest.raises(duckdb.Error):
+        replica._connection().execute("SET enable_external_access = true")
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import pytest
+
+from sql_guard import SqlGuard, SqlRejected
+
+TABLE = "gemini-web-agent-466416.Refah_CSV.table_CSV_Mapped_1000"
+FROM_TABLE = f"FROM `{TABLE}`"
+
+
+@pytest.fixture
+def guard():
+    return SqlGuard(TABLE, max_rows=1000, max_bytes_billed=10 ** 9, timeout=60)
+
+
+@pytest.mark.parametrize("sql", [
+    f"SELECT COUNT(*) {FROM_TABLE} WHERE ostan = '#'; DELETE FROM Refah_CSV.table_CSV_Mapped_1000 WHERE true",
+    f"SELECT id {FROM_TABLE} WHERE ostan = '--' UNION ALL SELECT id FROM other.secret",
+    f"SELECT id {FROM_TABLE} WHERE ostan = '/*' UNION ALL SELECT id FROM other.secret -- */",
+    f"SELECT * {FROM_TABLE}, `other-proj.secret.users`",
+    f"SELECT * {FROM_TABLE} t, other.secret s",
+    f"SELECT * {FROM_TABLE} AS t, UNNEST([1]) AS x, other.secret",
+    f"SELECT * {FROM_TABLE} t JOIN other.secret s ON t.id = s.id",
+    f"SELECT * {FROM_TABLE}, read_csv('/etc/passwd')",
+    f"SELECT p.* {FROM_TABLE} t, (PIVOT read_text('/etc/passwd') ON filename USING first(content)) p",
+    f"SELECT u.* {FROM_TABLE} t, (UNPIVOT other.secret ON COLUMNS(*) INTO NAME k VALUE v) u",
+    f"SELECT s.* {FROM_TABLE} t, (SUMMARIZE other.secret) s",
+    f"SELECT d.* {FROM_TABLE} t, (DESCRIBE other.secret) d",
+    f"SELECT * {FROM_TABLE} t, ((other.secret)) s",
+    f"SELECT id {FROM_TABLE} WHERE ostan = 'unterminated",
+    f"DELETE {FROM_TABLE} WHERE true",
+    f"SELECT 1; SELECT 2",
+])
+def test_rejects(guard, sql):
+    with pytest.raises(SqlRejected):
+        guard.check(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    f"SELECT COUNT(*) {FROM_TABLE} WHERE ostan = '#'",
+    f"SELECT COUNT(*) {FROM_TABLE} WHERE ostan = 'a;b' -- trailing comment",
+    f"SELECT ostan, COUNT(*) AS n {FROM_TABLE} t WHERE t.age > 30 GROUP BY ostan, gender",
+    f"WITH s AS (SELECT ostan {FROM_TABLE}) SELECT * FROM s, UNNEST([1, 2]) AS x WITH OFFSET AS i",
+    f"SELECT EXTRACT(YEAR FROM CURRENT_DATE()), (SELECT MAX(age) {FROM_TABLE}) AS oldest {FROM_TABLE}",
+    f"SELECT gender IS DISTINCT FROM urban {FROM_TABLE} AS t, UNNEST([1]) x",
+    f"SELECT * FROM ((SELECT ostan {FROM_TABLE})) AS s",
+    f"SELECT * FROM (`{TABLE}` AS a JOIN `{TABLE}` AS b USING (ostan))",
+])
+def test_accepts(guard, sql):
+    assert guard.check(sql).startswith(sql.split("--")[0].strip())
+
+
+def test_limit_after_comment_marker_in_literal_is_clamped(guard):
+    sql = f"SELECT id {FROM_TABLE} WHERE ostan = 'a--b' LIMIT 5000"
+    assert guard.check(sql) == f"SELECT id {FROM_TABLE} WHERE ostan = 'a--b' LIMIT 1000"
+
+
+def test_limit_injected_after_trailing_comment(guard):
+    sql = f"SELECT id {FROM_TABLE} -- all of them"
+    assert guard.check(sql) == f"{sql}\nLIMIT 1000"
+
+
+def test_dry_run_rejects_other_referenced_tables(guard):
+    refs = [SimpleNamespace(project="gemini-web-agent-466416", dataset_id="Refah_CSV", table_id="table_CSV_Mapped_1000"),
+            SimpleNamespace(project="other-proj", dataset_id="secret", table_id="users")]
+    client = SimpleNamespace(query=lambda sql, job_config: SimpleNamespace(referenced_tables=refs, total_bytes_processed=10))
+    with pytest.raises(SqlRejected, match="other-proj.secret.users"):
+        guard.dry_run(client, f"SELECT 1 {FROM_TABLE}")
+
+
+def test_dry_run_enforces_byte_budget(guard):
+    refs = [SimpleNamespace(project="gemini-web-agent-466416", dataset_id="Refah_CSV", table_id="table_CSV_Mapped_1000")]
+    client = SimpleNamespace(query=lambda sql, job_config: SimpleNamespace(referenced_tables=refs, total_bytes_processed=10 ** 10))
+    with pytest.raises(SqlRejected, match="byte limit"):
+        guard.dry_run(client, f"SELECT * {FROM_TABLE}")
+    client = SimpleNamespace(query=lambda sql, job_config: SimpleNamespace(referenced_tables=refs, total_bytes_processed=10))
+    assert guard.dry_run(client, f"SELECT * {FROM_TABLE}") == 10
@@ -1,22 +1,75 @@
 // src/components/DashboardCharts.tsx
 // REMOVED: import React, { useEffect, useState } from 'react';
 import { useEffect, useState } from 'react'; // Keep these hooks
-import { Box, Typography, CircularProgress, Alert } from '@mui/material';
+import {
+  Box, Typography, CircularProgress, Alert,
+  Table, TableBody, TableCell, TableHead, TableRow,
+} from '@mui/material';
 
-// --- CRITICAL FIX 1: Define the data row interface ---
-interface BigQueryDataRow {
-  // Adjust these properties and types based on your actual BigQuery data
-  // Example:
-  id?: string;
-  category: string;
-  value: number;
-  date?: string; // Optional property
-  // Add all properties that your BigQuery view might return
+// --- Columnar payload of /api/charts_data: one array per field, aligned by index ---
+interface Distribution {
+  label?: string[];
+  count: number[];
+  hadafmandi_rate: (number | null)[];
+  subsidy_cash_rate: (number | null)[];
+  // The dimension's own key array (gender / urban / age_band)
+  [key: string]: (string | number | null)[] | undefined;
+}
+
+interface ChartsData {
+  generated_at: string;
+  total: number;
+  coverage: {
+    hadafmandi: number | null;
+    subsidy_cash: number | null;
+  };
+  by_gender: Distribution;
+  by_urban: Distribution;
+  by_age_band: Distribution;
+  shaparak_yearly_avg: {
+    year: number[];
+    avg: (number | null)[];
+  };
+}
+
+const formatRate = (rate: number | null) => (rate === null ? '-' : `${(rate * 100).toFixed(1)}%`);
+const formatNumber = (value: number | null) => (value === null ? '-' : value.toLocaleString('fa-IR'));
+
+function DistributionTable({ title, dimension, distribution }: {
+  title: string;
+  dimension: string;
+  distribution: Distribution;
+}) {
+  const keys = distribution[dimension] ?? [];
+  return (
+    <Box sx={{ mb: 3 }}>
+      <Typography variant="subtitle1" gutterBottom>{title}</Typography>
+      <Table size="small">
+        <TableHead>
+          <TableRow>
+            <TableCell>گروه</TableCell>
+            <TableCell align="right">تعداد</TableCell>
+            <TableCell align="right">هدفمندی</TableCell>
+            <TableCell align="right">یارانه نقدی</TableCell>
+          </TableRow>
+        </TableHead>
+        <TableBody>
+          {distribution.count.map((count, i) => (
+            <TableRow key={String(keys[i] ?? i)}>
+              <TableCell>{distribution.label?.[i] ?? String(keys[i] ?? 'نامشخص')}</TableCell>
+              <TableCell align="right">{formatNumber(count)}</TableCell>
+              <TableCell align="right">{formatRate(distribution.hadafmandi_rate[i])}</TableCell>
+              <TableCell align="right">{formatRate(distribution.subsidy_cash_rate[i])}</TableCell>
+            </TableRow>
+          ))}
+        </TableBody>
+      </Table>
+    </Box>
+  );
 }
 
 function DashboardCharts() {
-  // --- CRITICAL FIX 2: Explicitly type the useState for data ---
-  const [data, setData] = useState<BigQueryDataRow[]>([]);
+  const [data, setData] = useState<ChartsData | null>(null);
   const [loading, setLoading] = useState<boolean>(true);
   const [error, setError] = useState<string | null>(null);
 
@@ -28,9 +81,9 @@ function DashboardCharts() {
         const response = await fetch(`${FLASK_API_BASE_URL}/api/charts_data`);
         if (!response.ok) {
           const errorData = await response.json();
-          throw new Error(errorData.details || 'Failed to fetch dashboard data');
+          throw new Error(errorData.error || errorData.details || 'Failed to fetch dashboard data');
         }
-        const result: BigQueryDataRow[] = await response.json(); // Explicitly type the parsed JSON
+        const result: ChartsData = await response.json(); // Explicitly type the parsed JSON
         setData(result);
       } catch (err: unknown) { // --- CRITICAL FIX 3: Type guard for 'err' ---
         console.error('Error fetching dashboard data:', err);
@@ -50,17 +103,38 @@ function DashboardCharts() {
 
   if (loading) return <CircularProgress />;
   if (error) return <Alert severity="error">Error: {error}</Alert>;
-  if (data.length === 0) return <Typography>No data available.</Typography>;
+  if (!data || data.total === 0) return <Typography>No data available.</Typography>;
 
   return (
     <Box>
-      <Typography variant="h6" gutterBottom>Sample Data (from Flask API)</Typography>
-      {/* You'll replace this with actual charts later, just showing data structure now */}
-      <pre style={{ overflowX: 'auto', whiteSpace: 'pre-wrap', wordWrap: 'break-word' }}>
-        {JSON.stringify(data.slice(0, 5), null, 2)}
-      </pre>
+      <Typography variant="h6" gutterBottom>
+        {`کل افراد: ${formatNumber(data.total)}`}
+      </Typography>
+      <Typography gutterBottom>
+        {`پوشش هدفمندی: ${formatRate(data.coverage.hadafmandi)} — پوشش یارانه نقدی: ${formatRate(data.coverage.subsidy_cash)}`}
+      </Typography>
+
+      <DistributionTable title="بر اساس جنسیت" dimension="gender" distribution={data.by_gender} />
+      <DistributionTable title="شهری / روستایی" dimension="urban" distribution={data.by_urban} />
+      <DistributionTable title="گروه سنی" dimension="age_band" distribution={data.by_age_band} />
+
+      <Typography variant="subtitle1" gutterBottom>میانگین ماهانه خرید شاپرک</Typography>
+      <Table size="small">
+        <TableBody>
+          {data.shaparak_yearly_avg.year.map((year, i) => (
+            <TableRow key={year}>
+              <TableCell>{year}</TableCell>
+              <TableCell align="right">{formatNumber(data.shaparak_yearly_avg.avg[i])}</TableCell>
+            </TableRow>
+          ))}
+        </TableBody>
+      </Table>
+
+      <Typography variant="caption" color="text.secondary">
+        {`به‌روزرسانی: ${new Date(data.generated_at).toLocaleString('fa-IR')}`}
+      </Typography>
     </Box>
   );
 }
 
-export default DashboardCharts;
\ No newline at end of file
+export default DashboardCharts;